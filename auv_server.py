@@ -0,0 +1,198 @@
+"""
+A real-time simulation server for the AUV in physics.py.
+Lets a controller drive the simulated AUV over a local socket, as a stand-in for the hardware.
+
+Clients exchange newline-delimited JSON messages:
+    {"thrusters": [t1, t2, t3, t4]}  sets the thruster command used from the next tick onwards
+    {"subscribe": true}              streams the state of the AUV back after every tick
+Each state message is a JSON object keyed by physics.AUV2_MOTION_COLUMNS.
+"""
+import asyncio
+import json
+import time
+import numpy as np
+import physics
+
+
+class AUVSimulationServer:
+    """
+    Advances the AUV at a fixed rate and streams its state to any number of subscribers.
+    Slow subscribers never hold up the simulation: each one has a bounded queue,
+    and the oldest unsent states are dropped when it fills up.
+    """
+
+    def __init__(
+        self,
+        alpha: float,
+        horizontal_distance: float,
+        vertical_distance: float,
+        moment_of_inertia: float = 100,
+        mass: float = 100,
+        time_step: float = 0.01,
+        max_thrust: float = None,
+        queue_size: int = 64,
+    ):
+        """
+        Initialize a server. The AUV starts at rest at the origin with all thrusters off.
+        Arguments:
+            alpha: float, the angle of the thrusters in radians
+            horizontal_distance: float, the horizontal distance to the thrusters in meters
+            vertical_distance: float, the vertical distance to the thrusters in meters
+            moment_of_inertia: float = 100, the moment of inertia of the AUV in kg * m^2
+            mass: float = 100, kg
+            time_step: float = 0.01, the simulated and wall-clock time between ticks in seconds
+            max_thrust: float = None, if given, thruster commands are clipped to [-max_thrust, max_thrust]
+            queue_size: int = 64, the number of states buffered for each subscriber
+        """
+        if time_step <= 0:
+            raise ValueError("Time step is less than or equal to 0.")
+        if queue_size <= 0:
+            raise ValueError("Queue size is less than or equal to 0.")
+        self.alpha = alpha
+        self.horizontal_distance = horizontal_distance
+        self.vertical_distance = vertical_distance
+        self.moment_of_inertia = moment_of_inertia
+        self.mass = mass
+        self.time_step = time_step
+        self.max_thrust = max_thrust
+        self.queue_size = queue_size
+
+        self.state = np.zeros(len(physics.AUV2_MOTION_COLUMNS))
+        self.thrusters = np.zeros(4)
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.dropped_states = 0
+        self.max_tick_duration = 0.0
+        self._subscribers = set()
+        self._clients = set()
+        self._server = None
+        self._tick_task = None
+
+    def set_thrusters(self, thrusters):
+        """
+        Sets the thruster command applied from the next tick onwards.
+        Raises a ValueError if <thrusters> does not hold 4 values.
+        """
+        thrusters = np.array(thrusters, dtype=float)
+        if np.shape(thrusters) != (4,):
+            raise ValueError("The shape of the thrusters vector is incorrect.")
+        if self.max_thrust is not None:
+            thrusters = np.clip(thrusters, -self.max_thrust, self.max_thrust)
+        self.thrusters = thrusters
+
+    def tick(self):
+        """
+        Advances the simulation by one time step and queues the new state for every subscriber.
+        """
+        started = time.perf_counter()
+        self.state = physics.step_auv2_motion(
+            self.state,
+            self.thrusters,
+            self.alpha,
+            self.horizontal_distance,
+            self.vertical_distance,
+            self.moment_of_inertia,
+            self.mass,
+            self.time_step,
+        )
+        self.ticks += 1
+        message = self.state_message()
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped_states += 1
+            queue.put_nowait(message)
+        self.max_tick_duration = max(
+            self.max_tick_duration, time.perf_counter() - started
+        )
+
+    def state_message(self) -> bytes:
+        """
+        Returns the current state of the AUV encoded as a newline-terminated JSON message.
+        """
+        state = dict(zip(physics.AUV2_MOTION_COLUMNS, self.state.tolist()))
+        return (json.dumps(state) + "\n").encode()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Starts accepting clients and advancing the simulation.
+        Returns the (host, port) the server is listening on.
+        """
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        self._tick_task = asyncio.create_task(self._run())
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        """
+        Stops the simulation and disconnects every client.
+        """
+        if self._tick_task is not None:
+            self._tick_task.cancel()
+            try:
+                await self._tick_task
+            except asyncio.CancelledError:
+                pass
+            self._tick_task = None
+        if self._server is not None:
+            self._server.close()
+            # Closing the server only stops new connections, the open ones are cancelled
+            # so they stop taking commands and close their sockets
+            clients = list(self._clients)
+            for client in clients:
+                client.cancel()
+            await asyncio.gather(*clients, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _run(self):
+        # Ticks are scheduled against absolute deadlines on the monotonic clock,
+        # so the rate does not drift with the time spent in each tick.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            self.tick()
+            deadline += self.time_step
+            now = loop.time()
+            if now > deadline:
+                # Running late: skip the ticks we cannot make up rather than bursting
+                missed = int((now - deadline) // self.time_step) + 1
+                self.missed_ticks += missed
+                deadline += missed * self.time_step
+            await asyncio.sleep(deadline - loop.time())
+
+    async def _handle_client(self, reader, writer):
+        queue = None
+        sender = None
+        self._clients.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if "thrusters" in request:
+                        self.set_thrusters(request["thrusters"])
+                    if request.get("subscribe") and queue is None:
+                        queue = asyncio.Queue(maxsize=self.queue_size)
+                        self._subscribers.add(queue)
+                        sender = asyncio.create_task(self._send_states(queue, writer))
+                except (ValueError, TypeError, AttributeError) as error:
+                    writer.write((json.dumps({"error": str(error)}) + "\n").encode())
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(asyncio.current_task())
+            if queue is not None:
+                self._subscribers.discard(queue)
+            if sender is not None:
+                sender.cancel()
+            writer.close()
+
+    async def _send_states(self, queue, writer):
+        try:
+            while True:
+                writer.write(await queue.get())
+                await writer.drain()
+        except ConnectionError:
+            pass
@@ -9,48 +9,540 @@ Create a simulation of a bank account.
     The account should have a method to deposit money.
     The account should have a method to print the current balance.
 """
+import array
+import bisect
+import collections
+import decimal
+import numbers
+import sys
+import threading
+import time
+import numpy as np
+
+
+def to_cents(amount) -> int:
+    """
+    Converts an amount of money to a whole number of cents, rounding to the nearest cent.
+    Amounts with a fraction of a cent are rounded rather than rejected, so float amounts
+    like 0.1 + 0.2 are taken as the cents they were meant to be.
+    Raises a TypeError if <amount> is not a number.
+    """
+    if not isinstance(amount, (numbers.Real, decimal.Decimal)):
+        raise TypeError(f"{amount!r} is not an amount of money!")
+    return int(round(amount * 100))
+
+
+def from_cents(cents: int) -> float:
+    """
+    Converts a whole number of cents back to an amount of money.
+    """
+    return cents / 100
+
+
+# An account being opened or closed, or a deposit, withdrawal, balance enquiry or change of
+# balance on it, passed to the account's sink. The amount of an "open" event is the balance the
+# account was opened with, and the amount of an "adjust" event is the change in balance when
+# it is set directly.
+TransactionEvent = collections.namedtuple(
+    "TransactionEvent", ["timestamp", "kind", "account_number", "amount", "balance"]
+)
+
+
+class PrintSink:
+    """
+    Prints a message for each event, as a person at the account would expect to see.
+    """
+    def emit(self, event: TransactionEvent):
+        if event.kind == "withdraw":
+            print(f"You have successfully withdrawn {event.amount} from your account.")
+        elif event.kind == "deposit":
+            print(f"You have deposited {event.amount} to your account.")
+        elif event.kind == "balance":
+            print(f"Your current balance is {event.balance}.")
+
+
+class NullSink:
+    """
+    Discards every event.
+    """
+    def emit(self, event: TransactionEvent):
+        pass
+
+
+class RingBufferSink:
+    """
+    Keeps the most recent events in memory.
+    """
+    def __init__(self, capacity: int = 10000):
+        """
+        Initialize the buffer.
+        Arguments:
+            capacity: int, the number of events kept, older events are discarded
+        """
+        if capacity <= 0:
+            raise ValueError(f"{capacity} is less than or equal to 0!")
+        self.events = collections.deque(maxlen=capacity)
+        self.emit = self.events.append
+
+
+class BatchedFileSink:
+    """
+    Writes events to a file as tab separated lines, in batches.
+    A batch is written once <flush_every> events are waiting, and a background thread
+    writes the waiting events every <flush_interval> seconds, so none waits longer than that.
+    Call close when done with the sink, to write the last events and stop the thread.
+    """
+    def __init__(self, file, flush_every: int = 1000, flush_interval: float = 0.1):
+        """
+        Initialize the sink.
+        Arguments:
+            file: the path of the file to append to, or an open text file
+            flush_every: int, the number of events in a batch
+            flush_interval: float, the longest time in seconds an event waits to be written,
+                            0 to write every event as it arrives
+        """
+        if flush_every <= 0:
+            raise ValueError(f"{flush_every} is less than or equal to 0!")
+        if flush_interval < 0:
+            raise ValueError(f"{flush_interval} is less than 0!")
+        self._owns_file = isinstance(file, str)
+        self.file = open(file, "a") if self._owns_file else file
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending = collections.deque()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def emit(self, event: TransactionEvent):
+        self._pending.append(event)
+        if len(self._pending) >= self.flush_every or not self.flush_interval:
+            self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            if self._pending:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes every waiting event to the file.
+        """
+        with self._flush_lock:
+            # Events may still be added while writing, they are left for the next batch
+            events = [self._pending.popleft() for _ in range(len(self._pending))]
+            if events:
+                self.file.write("".join("\t".join(map(str, event)) + "\n" for event in events))
+                self.file.flush()
+
+    def close(self):
+        """
+        Writes every waiting event and closes the file if the sink opened it.
+        """
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        if self._owns_file:
+            self.file.close()
+
+
+class BalanceHistory:
+    """
+    The balance of an account over time, as two compact arrays of timestamps and balances in cents.
+    Recording a balance is two appends, and finding the balance at a point in time is a binary search.
+    """
+    def __init__(self):
+        self.timestamps = array.array("d")
+        self.balances_cents = array.array("q")
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def record(self, timestamp: float, cents: int):
+        """
+        Records that the balance became <cents> at <timestamp>.
+        A timestamp earlier than the last one, from the clock being set back, is moved up to it.
+        """
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            timestamp = self.timestamps[-1]
+        self.timestamps.append(timestamp)
+        self.balances_cents.append(cents)
+
+    def balance_at(self, timestamp: float):
+        """
+        Returns the balance at <timestamp>, or None if nothing was recorded by then.
+        """
+        index = bisect.bisect_right(self.timestamps, timestamp) - 1
+        if index < 0:
+            return None
+        return from_cents(self.balances_cents[index])
+
+    def compact(self, before: float, resolution: float):
+        """
+        Thins out the entries older than <before>, keeping only the last balance in each
+        period of <resolution> seconds, and the first balance ever recorded. Queries in that
+        range then see the balance at the end of the period before, and queries after the
+        first entry still find a balance.
+        """
+        if resolution <= 0:
+            raise ValueError(f"{resolution} is less than or equal to 0!")
+        end = bisect.bisect_left(self.timestamps, before)
+        if end == 0:
+            return
+        timestamps = np.array(self.timestamps[:end])
+        balances = np.array(self.balances_cents[:end])
+        periods = np.floor(timestamps / resolution)
+        keep = np.ones(end, dtype=bool)
+        keep[:-1] = periods[1:] != periods[:-1]
+        keep[0] = True
+        self.timestamps[:end] = array.array("d", timestamps[keep].tobytes())
+        self.balances_cents[:end] = array.array("q", balances[keep].tobytes())
+
+
+# The sink used by accounts that are not given one
+default_sink = PrintSink()
+
+
 class BankAccount:
     """
     A representation of a bank account, with balance, name, and account number.
+    The balance is kept as a whole number of cents, so it never drifts the way
+    a float does over many deposits and withdrawals.
     """
-    def __init__(self, name: str, account_number: int,  balance: int or float = 0):
+    # No per-account __dict__, which matters when millions of accounts are kept in memory
+    __slots__ = ("name", "balance_cents", "account_number", "lock", "sink", "history")
+
+    def __init__(self, name: str, account_number: int,  balance: int or float = 0, lock=None, sink=None, keep_history: bool = False):
         """
         Initialize an account. 
         Arguments:
             name: str, the name of the account
             account_number: the number representing the account id
             balance: the amount of money stored in the account
+            lock: the re-entrant lock guarding the balance, shared with other accounts
+                  when it comes from AccountLocks. A new lock is created if not given.
+            sink: the object whose emit method receives a TransactionEvent for each operation,
+                  default_sink if not given
+            keep_history: bool, whether to record the balance after every change in a BalanceHistory
         """
         self.name = name
-        self.balance = balance
+        self.balance_cents = to_cents(balance)
         self.account_number = account_number
+        self.lock = lock if lock is not None else threading.RLock()
+        self.sink = sink if sink is not None else default_sink
+        self.history = None
+        timestamp = time.time()
+        if keep_history:
+            self.history = BalanceHistory()
+            self.history.record(timestamp, self.balance_cents)
+        self.sink.emit(TransactionEvent(timestamp, "open", account_number, balance, self.balance))
+
+    @property
+    def balance(self) -> float:
+        """
+        The amount of money stored in the account.
+        """
+        return from_cents(self.balance_cents)
+
+    @balance.setter
+    def balance(self, balance: int or float):
+        cents = to_cents(balance)
+        timestamp = time.time()
+        with self.lock:
+            change = cents - self.balance_cents
+            self.balance_cents = cents
+            if self.history is not None:
+                self.history.record(timestamp, cents)
+        self.sink.emit(TransactionEvent(timestamp, "adjust", self.account_number, from_cents(change), from_cents(cents)))
+
+    def balance_at(self, timestamp: float):
+        """
+        Returns the balance of the account at <timestamp>, or None if the account did not exist yet.
+        Raises a ValueError if the account does not keep a history.
+        """
+        if self.history is None:
+            raise ValueError(f"Account {self.account_number} does not keep a history!")
+        with self.lock:
+            return self.history.balance_at(timestamp)
 
     def withdraw(self, quantity: int or float):
         """
-        Withdraws <quantity: int> from the account. 
+        Withdraws <quantity: int> from the account, rounded to the nearest cent. 
         Throws a ValueError if <quantity> is less than 0, 
         or greater than the balance of the account.
         """
-        if quantity < 0:
-            raise ValueError(f"{quantity} is less than 0!")
-        if self.balance >= quantity:
-            self.balance -= quantity
-            print(f"You have successfully withdrawn {quantity} from your account.")
-        else:
-            raise ValueError(f"You don't have enough money in your account to withdraw {quantity}!")
+        timestamp = time.time()
+        with self.lock:
+            balance = self._change("withdraw", quantity, timestamp)
+        self._report(timestamp, "withdraw", quantity, balance)
     
     def deposit(self, quantity: int or float):
         """
-        Deposits <quantity: int> into the account.
+        Deposits <quantity: int> into the account, rounded to the nearest cent.
         Raises a ValueError if <quantity> is less than 0.
         """
+        timestamp = time.time()
+        with self.lock:
+            balance = self._change("deposit", quantity, timestamp)
+        self._report(timestamp, "deposit", quantity, balance)
+
+    def apply_batch(self, requests) -> list:
+        """
+        Applies a batch of deposits and withdrawals in order under a single acquisition of the lock,
+        each as if it were made with deposit or withdraw.
+        Arguments:
+            requests: a sequence of (kind, quantity) pairs, where kind is "deposit" or "withdraw"
+        Returns:
+            list: for each request the new balance, or the exception it raised instead,
+                  including one raised by the sink when it was reported
+        """
+        timestamp = time.time()
+        results = []
+        with self.lock:
+            for kind, quantity in requests:
+                try:
+                    results.append(self._change(kind, quantity, timestamp))
+                except (TypeError, ValueError) as error:
+                    results.append(error)
+        for index, ((kind, quantity), result) in enumerate(zip(requests, results)):
+            if isinstance(result, Exception):
+                continue
+            try:
+                self._report(timestamp, kind, quantity, result)
+                results[index] = from_cents(result)
+            except Exception as error:
+                results[index] = error
+        return results
+
+    def _change(self, kind: str, quantity, timestamp: float) -> int:
+        # Applies a deposit or withdrawal and returns the new balance in cents. The caller
+        # holds the lock, and reports the change to the sink once it has released it.
+        if kind not in ("deposit", "withdraw"):
+            raise ValueError(f"{kind!r} is not a deposit or a withdrawal!")
+        cents = to_cents(quantity)
         if quantity < 0:
             raise ValueError(f"{quantity} is less than 0!")
-        self.balance += quantity
-        print(f"You have deposited {quantity} to your account.") 
+        if kind == "withdraw":
+            if self.balance_cents < cents:
+                raise ValueError(f"You don't have enough money in your account to withdraw {quantity}!")
+            cents = -cents
+        self.balance_cents += cents
+        if self.history is not None:
+            self.history.record(timestamp, self.balance_cents)
+        return self.balance_cents
+
+    def _report(self, timestamp: float, kind: str, quantity, balance_cents: int):
+        self.sink.emit(TransactionEvent(timestamp, kind, self.account_number, quantity, from_cents(balance_cents)))
 
     def print_balance(self):
         """
-        Prints the balance of the account.
+        Reports the balance of the account to the account's sink,
+        which prints it unless the account was given a different sink.
+        """
+        self.sink.emit(TransactionEvent(time.time(), "balance", self.account_number, 0, self.balance))
+
+
+class AccountLocks:
+    """
+    A fixed set of locks striped across accounts by account number.
+    Accounts on different stripes never contend with each other, and millions of
+    accounts can share a bounded number of locks.
+    """
+    def __init__(self, stripes: int = 64):
+        """
+        Initialize the locks.
+        Arguments:
+            stripes: int, the number of locks to spread the accounts over
+        """
+        if stripes <= 0:
+            raise ValueError(f"{stripes} is less than or equal to 0!")
+        self.stripes = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, account_number: int) -> threading.RLock:
+        """
+        Returns the lock guarding the account with <account_number>.
+        """
+        return self.stripes[hash(account_number) % len(self.stripes)]
+
+    def open_account(self, name: str, account_number: int, balance: int or float = 0, sink=None, keep_history: bool = False) -> BankAccount:
+        """
+        Creates an account guarded by the stripe for <account_number>.
+        """
+        return BankAccount(name, account_number, balance, self.lock_for(account_number), sink, keep_history)
+
+
+class AccountRegistry:
+    """
+    A collection of accounts, indexed by account number and by name.
+    Accounts share the striped locks of an AccountLocks, rather than having one lock each.
+    """
+    def __init__(self, stripes: int = 64, sink=None, keep_history: bool = False):
+        """
+        Initialize an empty registry.
+        Arguments:
+            stripes: int, the number of locks shared by the accounts
+            sink: the sink given to every account opened in the registry, default_sink if not given
+            keep_history: bool, whether the accounts opened in the registry keep a BalanceHistory
+        """
+        self.locks = AccountLocks(stripes)
+        self.sink = sink
+        self.keep_history = keep_history
+        self._accounts = {}
+        # The account number of each name, or a list of them for the names shared by several
+        # accounts, so a unique name costs one entry rather than a container of its own
+        self._names = {}
+        # Sorted lazily, so opening many accounts does not keep re-sorting
+        self._sorted_numbers = []
+        self._lock = threading.Lock()
+
+    def open_account(self, name: str, account_number: int, balance: int or float = 0) -> BankAccount:
+        """
+        Creates an account and adds it to the registry.
+        Raises a ValueError if <account_number> is already in use.
+        """
+        with self._lock:
+            # Checked before the account is created, so a rejected account emits no events
+            if account_number in self._accounts:
+                raise ValueError(f"Account {account_number} already exists!")
+            account = self.locks.open_account(name, account_number, balance, self.sink, self.keep_history)
+            self._accounts[account_number] = account
+            named = self._names.get(name)
+            if named is None:
+                self._names[name] = account_number
+            elif isinstance(named, list):
+                named.append(account_number)
+            else:
+                self._names[name] = [named, account_number]
+            self._sorted_numbers = None
+        return account
+
+    def close_account(self, account_number: int) -> BankAccount:
+        """
+        Removes the account with <account_number> from the registry and returns it,
+        reporting a "close" event to its sink.
+        Raises a KeyError if there is no such account.
+        """
+        with self._lock:
+            account = self._accounts.pop(account_number)
+            account.sink.emit(TransactionEvent(time.time(), "close", account_number, 0, account.balance))
+            named = self._names[account.name]
+            if isinstance(named, list):
+                named.remove(account_number)
+                if len(named) == 1:
+                    self._names[account.name] = named[0]
+            else:
+                del self._names[account.name]
+            self._sorted_numbers = None
+        return account
+
+    def __getitem__(self, account_number: int) -> BankAccount:
+        return self._accounts[account_number]
+
+    def __contains__(self, account_number: int) -> bool:
+        return account_number in self._accounts
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+    def __iter__(self):
+        """
+        Iterates over the accounts in order of account number.
         """
-        print(f"Your current balance is {self.balance}.")
+        return iter(self.accounts_in_range())
+
+    def find_by_name(self, name: str) -> list:
+        """
+        Returns every account with <name>, in the order they were opened.
+        """
+        named = self._names.get(name)
+        if named is None:
+            return []
+        if not isinstance(named, list):
+            return [self._accounts[named]]
+        return [self._accounts[account_number] for account_number in named]
+
+    def accounts_in_range(self, low: int = None, high: int = None) -> list:
+        """
+        Returns the accounts with numbers from <low> up to but not including <high>,
+        in order of account number. A missing bound means the range is open on that side.
+        """
+        with self._lock:
+            if self._sorted_numbers is None:
+                self._sorted_numbers = sorted(self._accounts)
+            numbers = self._sorted_numbers
+            start = 0 if low is None else bisect.bisect_left(numbers, low)
+            end = len(numbers) if high is None else bisect.bisect_left(numbers, high)
+            return [self._accounts[number] for number in numbers[start:end]]
+
+    def balances_at(self, timestamp: float, account_numbers=None) -> dict:
+        """
+        Returns the balance at <timestamp> of each of <account_numbers>, or of every account,
+        as a dict from account number to balance. Accounts that did not exist yet are left out.
+        Raises a ValueError if the registry does not keep histories.
+        """
+        if not self.keep_history:
+            raise ValueError("The accounts in this registry do not keep a history!")
+        if account_numbers is None:
+            account_numbers = list(self._accounts)
+        balances = {}
+        for account_number in account_numbers:
+            balance = self._accounts[account_number].balance_at(timestamp)
+            if balance is not None:
+                balances[account_number] = balance
+        return balances
+
+    def compact_histories(self, before: float, resolution: float):
+        """
+        Compacts the history of every account, see BalanceHistory.compact.
+        Meant to be called periodically, for example once a day.
+        """
+        for account in list(self._accounts.values()):
+            if account.history is not None:
+                with account.lock:
+                    account.history.compact(before, resolution)
+
+    def memory_usage(self) -> int:
+        """
+        Estimates the memory used by the registry in bytes: the accounts, their names and
+        histories, the indexes and the shared locks. The balance and number objects are not counted.
+        """
+        with self._lock:
+            size = sys.getsizeof(self._accounts) + sys.getsizeof(self._names)
+            size += sum(sys.getsizeof(named) for named in self._names.values() if isinstance(named, list))
+            size += sum(sys.getsizeof(name) for name in self._names)
+            size += sum(sys.getsizeof(account) for account in self._accounts.values())
+            size += sum(
+                sys.getsizeof(account.history.timestamps)
+                + sys.getsizeof(account.history.balances_cents)
+                for account in self._accounts.values()
+                if account.history is not None
+            )
+            if self._sorted_numbers is not None:
+                size += sys.getsizeof(self._sorted_numbers)
+            size += sum(sys.getsizeof(lock) for lock in self.locks.stripes)
+            return size
+
+
+def transfer(source: BankAccount, destination: BankAccount, quantity: int or float):
+    """
+    Moves <quantity> from <source> to <destination> as a single atomic operation.
+    Both locks are taken in a fixed global order, so two opposite transfers cannot deadlock.
+    Raises a ValueError if <quantity> is less than 0, or greater than the balance of <source>,
+    in which case neither account is changed.
+    """
+    if quantity < 0:
+        raise ValueError(f"{quantity} is less than 0!")
+    # The same stripe may guard both accounts; the locks are re-entrant but only need taking once
+    locks = sorted({id(source.lock): source.lock, id(destination.lock): destination.lock}.items())
+    for _, lock in locks:
+        lock.acquire()
+    try:
+        source.withdraw(quantity)
+        destination.deposit(quantity)
+    finally:
+        for _, lock in reversed(locks):
+            lock.release()
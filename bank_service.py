@@ -0,0 +1,91 @@
+"""
+An asyncio front end for the accounts in a bank.AccountRegistry.
+Requests that arrive close together are gathered into micro-batches, and every batch for an
+account is applied under a single acquisition of its lock, instead of one call per request.
+"""
+import asyncio
+from bank import AccountRegistry
+
+
+class AccountService:
+    """
+    Applies deposits and withdrawals to the accounts of a registry in micro-batches.
+    Requests for the same account are applied in the order they were made, and each caller
+    gets the result of its own request: the new balance, or the error it caused.
+    """
+
+    def __init__(
+        self, registry: AccountRegistry, window: float = 0.001, max_batch: int = 1024
+    ):
+        """
+        Initialize the service.
+        Arguments:
+            registry: AccountRegistry, the accounts the service works on
+            window: float, how long in seconds the first request of a batch waits for others
+            max_batch: int, the number of waiting requests that are applied without waiting any longer
+        """
+        if window < 0:
+            raise ValueError(f"{window} is less than 0!")
+        if max_batch <= 0:
+            raise ValueError(f"{max_batch} is less than or equal to 0!")
+        self.registry = registry
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self._pending = {}
+        self._pending_count = 0
+        self._flush_handle = None
+
+    async def deposit(self, account_number: int, quantity: int or float) -> float:
+        """
+        Deposits <quantity> into the account with <account_number> and returns its new balance.
+        Raises a ValueError if <quantity> is less than 0, or a KeyError if there is no such account.
+        """
+        return await self._submit("deposit", account_number, quantity)
+
+    async def withdraw(self, account_number: int, quantity: int or float) -> float:
+        """
+        Withdraws <quantity> from the account with <account_number> and returns its new balance.
+        Raises a ValueError if <quantity> is less than 0, or greater than the balance of the account,
+        or a KeyError if there is no such account.
+        """
+        return await self._submit("withdraw", account_number, quantity)
+
+    def _submit(self, kind: str, account_number: int, quantity) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(account_number, []).append((kind, quantity, future))
+        self._pending_count += 1
+        if self._pending_count >= self.max_batch:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self.flush)
+        return future
+
+    def flush(self):
+        """
+        Applies every waiting request now.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        self._pending_count = 0
+        if pending:
+            self.batches += 1
+        for account_number, requests in pending.items():
+            # Every caller gets a result or an exception, whatever goes wrong with an account
+            try:
+                account = self.registry[account_number]
+                results = account.apply_batch(
+                    [(kind, quantity) for kind, quantity, _ in requests]
+                )
+            except Exception as error:
+                results = [error] * len(requests)
+            for (_, _, future), result in zip(requests, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
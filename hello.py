@@ -1,58 +1,302 @@
+import concurrent.futures
+import contextlib
+import functools
+import math
+import os
+import threading
 import numpy as np
 
+# Every math helper below is a NumPy ufunc call, so it works element-wise on arrays and accepts:
+#   out: an array to write the result into, so chained calls need no temporaries
+#   where: a mask of the elements to compute, the others are left as they are in <out>
+#   dtype: the type to compute and return the result in
+# Inside a lazy() block, or when given an Expression, they build an Expression instead.
+# sin, cos, tan, cot, log, exp and power also accept workers and chunk_size, to split large
+# arrays into chunks that a pool of threads computes into the same output array.
+
+# The number of elements evaluated at a time by Expression.evaluate, small enough that the
+# temporaries of a long chain of operations stay in the CPU cache
+DEFAULT_CHUNK_SIZE = 16384
+
+_lazy_mode = threading.local()
+
+
+@contextlib.contextmanager
+def lazy():
+    """
+    Makes the math helpers build an Expression instead of computing their result.
+    """
+    previous = getattr(_lazy_mode, "active", False)
+    _lazy_mode.active = True
+    try:
+        yield
+    finally:
+        _lazy_mode.active = previous
+
+
+def _lazy_capable(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if getattr(_lazy_mode, "active", False) or any(
+            isinstance(arg, Expression) for arg in args
+        ):
+            if kwargs.pop("out", None) is not None:
+                raise ValueError("Pass out to Expression.evaluate instead!")
+            if "workers" in kwargs or "chunk_size" in kwargs:
+                raise ValueError(
+                    "Pass workers and chunk_size to Expression.evaluate instead!"
+                )
+            return Expression(function, args, kwargs)
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+def _parallel_capable(function):
+    @functools.wraps(function)
+    def wrapper(*args, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers <= 0:
+            raise ValueError(f"{workers} is less than or equal to 0!")
+        if workers == 1:
+            return function(*args, **kwargs)
+        out = kwargs.pop("out", None)
+        return Expression(function, args, kwargs).evaluate(out, chunk_size, workers)
+
+    return wrapper
+
+
+def _chunk_indices(shape, chunk_size):
+    # Index tuples of blocks of at most <chunk_size> elements, made of whole trailing axes,
+    # a range of the axis before them and a single position on every axis before that,
+    # so the chunks of any input, broadcast or not, are views of it
+    axis = len(shape) - 1
+    inner = 1
+    while axis > 0 and inner * shape[axis] <= chunk_size:
+        inner *= shape[axis]
+        axis -= 1
+    step = max(1, chunk_size // inner)
+    for outer in np.ndindex(*shape[:axis]):
+        for start in range(0, shape[axis], step):
+            yield (*outer, slice(start, start + step))
+
+
+def _map_chunks(function, chunks, workers):
+    # Calls function(chunks_of_one_worker) for each worker, each worker taking every
+    # <workers>-th chunk so the work is spread evenly
+    workers = max(1, min(workers, len(chunks)))
+    if workers == 1:
+        function(chunks)
+        return
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        for result in [
+            executor.submit(function, chunks[worker::workers])
+            for worker in range(workers)
+        ]:
+            result.result()
+
+
+class Expression:
+    """
+    A deferred call to one of the math helpers, whose arguments may be other Expressions.
+    Evaluating it runs the whole chain of calls over one chunk of the input at a time,
+    so no full-size temporary array is made for the intermediate results.
+    """
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        # Sequences like lists become arrays so they can be cut into chunks, scalars are
+        # kept as they are so they don't change the type of the result
+        self.args = tuple(self._as_input(arg) for arg in args)
+        self.kwargs = {key: self._as_input(value) for key, value in kwargs.items()}
+
+    @staticmethod
+    def _as_input(value):
+        if isinstance(value, (list, tuple)):
+            return np.asarray(value)
+        return value
+
+    def _leaves(self):
+        # Keyword arguments like dtype are not inputs, only masks like where are
+        masks = [
+            value for value in self.kwargs.values() if isinstance(value, np.ndarray)
+        ]
+        for value in (*self.args, *masks):
+            if isinstance(value, Expression):
+                yield from value._leaves()
+            else:
+                yield value
+
+    @property
+    def shape(self) -> tuple:
+        """
+        The shape of the result, from broadcasting every input together.
+        """
+        return np.broadcast_shapes(*(np.shape(leaf) for leaf in self._leaves()))
+
+    def __array__(self, dtype=None, copy=None):
+        result = np.asarray(self.evaluate())
+        return result if dtype is None else result.astype(dtype)
+
+    def evaluate(
+        self, out=None, chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 1
+    ):
+        """
+        Computes the value of the expression.
+        Arguments:
+            out: an array to write the result into, allocated if not given
+            chunk_size: int, the number of elements computed at a time
+            workers: int, the number of threads the chunks are shared between
+        Returns:
+            the result, which is <out> if it was given
+        """
+        if chunk_size <= 0:
+            raise ValueError("The chunk size must be greater than 0!")
+        shape = self.shape
+        if out is not None and out.shape != shape:
+            raise ValueError(
+                f"out has shape {out.shape}, the result has shape {shape}!"
+            )
+        if shape == () or math.prod(shape) == 0:
+            return self._evaluate(shape, (), {}, {}, out)
+
+        chunks = list(_chunk_indices(shape, chunk_size))
+        if out is None:
+            # The type of the result is only known once a chunk has been computed
+            first = self._evaluate(shape, chunks[0], {}, {})
+            out = np.empty(shape, dtype=first.dtype)
+            out[chunks[0]] = first
+            chunks = chunks[1:]
+
+        def evaluate_chunks(worker_chunks):
+            scratch = {}
+            for chunk in worker_chunks:
+                self._evaluate(shape, chunk, scratch, {}, out[chunk])
+
+        _map_chunks(evaluate_chunks, chunks, workers)
+        return out
+
+    def _evaluate(self, shape, chunk, scratch, computed, out=None):
+        # <scratch> holds a buffer per expression that is reused for every chunk,
+        # <computed> the results of this chunk so expressions used twice are computed once
+        if id(self) in computed:
+            return computed[id(self)]
+
+        def resolve(value):
+            if isinstance(value, Expression):
+                return value._evaluate(shape, chunk, scratch, computed)
+            if isinstance(value, np.ndarray) and value.ndim > 0:
+                return np.broadcast_to(value, shape)[chunk]
+            return value
+
+        args = [resolve(arg) for arg in self.args]
+        kwargs = {key: resolve(value) for key, value in self.kwargs.items()}
+        if out is None and id(self) in scratch:
+            buffer = scratch[id(self)]
+            # Chunks only differ in the length of their range, the last index
+            rows = len(range(*chunk[-1].indices(shape[len(chunk) - 1])))
+            if buffer.shape[0] >= rows:
+                out = buffer[:rows]
+        result = self.function(*args, out=out, **kwargs)
+        if out is None and isinstance(result, np.ndarray) and result.ndim > 0:
+            scratch[id(self)] = result
+        computed[id(self)] = result
+        return result
+
 
 def hello():
     return ("Hello, world!")
 
 
-def add(a, b):
-    return a + b
+@_lazy_capable
+def add(a, b, out=None, where=True, dtype=None):
+    return np.add(a, b, out=out, where=where, dtype=dtype)
 
 
-def sub(a, b):
-    return a - b
+@_lazy_capable
+def sub(a, b, out=None, where=True, dtype=None):
+    return np.subtract(a, b, out=out, where=where, dtype=dtype)
 
 
-def mul(a, b):
-    return a * b
+@_lazy_capable
+def mul(a, b, out=None, where=True, dtype=None):
+    return np.multiply(a, b, out=out, where=where, dtype=dtype)
 
 
-def div(a, b):
-    if b == 0:
-        raise ValueError("Can't divide by zero!")
-    return a / b
+@_lazy_capable
+def div(a, b, out=None, where=True, dtype=None, zero_division="raise"):
+    """
+    Divides <a> by <b> element-wise.
+    By default raises a ValueError if any divisor is 0. Otherwise <zero_division> is the
+    value given to the elements with a divisor of 0, which are never divided.
+    """
+    # Lists are converted up front, as the shape and the type of the result are taken from them
+    a, b = (np.asarray(x) if isinstance(x, (list, tuple)) else x for x in (a, b))
+    nonzero = np.not_equal(b, 0)
+    if zero_division == "raise":
+        if not np.all(nonzero | np.logical_not(where)):
+            raise ValueError("Can't divide by zero!")
+        return np.divide(a, b, out=out, where=where, dtype=dtype)
+    if out is None:
+        shape = np.broadcast_shapes(np.shape(a), np.shape(b), np.shape(where))
+        if dtype is None:
+            dtype = np.result_type(a, b, 1.0)
+        out = np.empty(shape, dtype=dtype)
+    np.copyto(out, zero_division, where=np.logical_and(where, np.logical_not(nonzero)))
+    result = np.divide(a, b, out=out, where=np.logical_and(where, nonzero), dtype=dtype)
+    return result if result.ndim else result[()]
 
 
-def sqrt(a):
-    return np.sqrt(a)
+@_lazy_capable
+def sqrt(a, out=None, where=True, dtype=None):
+    return np.sqrt(a, out=out, where=where, dtype=dtype)
 
 
-def power(a, b):
-    return np.power(a, b)
+@_lazy_capable
+@_parallel_capable
+def power(a, b, out=None, where=True, dtype=None):
+    return np.power(a, b, out=out, where=where, dtype=dtype)
 
 
-def log(a):
-    return np.log(a)
+@_lazy_capable
+@_parallel_capable
+def log(a, out=None, where=True, dtype=None):
+    return np.log(a, out=out, where=where, dtype=dtype)
 
 
-def exp(a):
-    return np.exp(a)
+@_lazy_capable
+@_parallel_capable
+def exp(a, out=None, where=True, dtype=None):
+    return np.exp(a, out=out, where=where, dtype=dtype)
 
 
-def sin(a):
-    return np.sin(a)
+@_lazy_capable
+@_parallel_capable
+def sin(a, out=None, where=True, dtype=None):
+    return np.sin(a, out=out, where=where, dtype=dtype)
 
 
-def cos(a):
-    return np.cos(a)
+@_lazy_capable
+@_parallel_capable
+def cos(a, out=None, where=True, dtype=None):
+    return np.cos(a, out=out, where=where, dtype=dtype)
 
 
-def tan(a):
-    return np.tan(a)
+@_lazy_capable
+@_parallel_capable
+def tan(a, out=None, where=True, dtype=None):
+    return np.tan(a, out=out, where=where, dtype=dtype)
 
 
-def cot(a):
-    return 1 / np.tan(a)
+@_lazy_capable
+@_parallel_capable
+def cot(a, out=None, where=True, dtype=None):
+    result = np.tan(a, out=out, where=where, dtype=dtype)
+    if isinstance(result, np.ndarray):
+        # The reciprocal is taken in place, so no temporary is made for the tangent
+        return np.divide(1, result, out=result, where=where)
+    return 1 / result
 
 
 def __main__():
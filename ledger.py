@@ -0,0 +1,417 @@
+"""
+A columnar store of account balances, for applying large batches of transactions at once.
+Where bank.BankAccount handles one account and one transaction per call, a Ledger keeps
+every balance in a single array indexed by account number.
+Like BankAccount, balances are stored as whole numbers of cents.
+"""
+import os
+import struct
+import threading
+import numpy as np
+from bank import from_cents, to_cents
+
+DEPOSIT = 0
+WITHDRAW = 1
+# Only found in the transaction log, where they record an account being opened with a balance
+# and being closed, after which its number may be opened again
+OPEN = 2
+CLOSE = 3
+
+# The layout of each record of a transaction log
+LOG_RECORD = np.dtype(
+    [("account_number", "<i8"), ("amount_cents", "<i8"), ("type", "u1")], align=False
+)
+# Snapshots start with a header holding the log offset they were taken at and the number of
+# accounts, followed by the account numbers and then the balances, each as one contiguous block
+_SNAPSHOT_HEADER = struct.Struct("<8sqq")
+_SNAPSHOT_MAGIC = b"LEDGSNAP"
+
+
+def _amounts_to_cents(amounts, cents: bool):
+    # Returns the amounts rounded to the nearest cent, and a mask of the amounts that are
+    # valid: finite and not less than 0 before rounding, like BankAccount checks them
+    if cents:
+        amounts = np.asarray(amounts, dtype=np.int64).ravel()
+        return amounts, amounts >= 0
+    amounts = np.asarray(amounts, dtype=np.float64).ravel()
+    valid = np.isfinite(amounts) & (amounts >= 0)
+    return np.rint(np.where(valid, amounts, 0) * 100).astype(np.int64), valid
+
+
+# The number of vectorized passes over overdrawn accounts before falling back to a plain loop
+_VECTORIZED_REJECTION_ROUNDS = 8
+
+
+class Ledger:
+    """
+    The balances of many accounts, stored as arrays sorted by account number.
+    balances_cents holds the balance of each account in cents, as an int64 array.
+    """
+
+    def __init__(
+        self, account_numbers=(), balances=None, log=None, cents: bool = False
+    ):
+        """
+        Initialize a ledger.
+        Arguments:
+            account_numbers: the numbers of the accounts in the ledger
+            balances: the starting balance of each account, 0 if not given
+            log: the TransactionLog every change to the ledger is written to, if any
+            cents: bool, whether <balances> are whole numbers of cents rather than amounts of money
+        """
+        self.account_numbers = np.zeros(0, dtype=np.int64)
+        self.balances_cents = np.zeros(0, dtype=np.int64)
+        self.log = log
+        self.open_accounts(account_numbers, balances, cents)
+
+    def __len__(self):
+        return len(self.account_numbers)
+
+    def open_accounts(self, account_numbers, balances=None, cents: bool = False):
+        """
+        Adds accounts to the ledger.
+        <balances> are amounts of money, or whole numbers of cents if <cents> is True.
+        Raises a ValueError if an account number is already in use or repeated,
+        or if a balance is less than 0.
+        """
+        account_numbers = np.asarray(account_numbers, dtype=np.int64).ravel()
+        if balances is None:
+            balances = np.zeros(len(account_numbers), dtype=np.int64)
+            cents = True
+        balances, valid = _amounts_to_cents(balances, cents)
+        if balances.shape != account_numbers.shape:
+            raise ValueError("There must be one balance for each account number!")
+        if not np.all(valid):
+            raise ValueError("Balances must not be less than 0!")
+        merged = np.concatenate([self.account_numbers, account_numbers])
+        order = np.argsort(merged, kind="stable")
+        merged = merged[order]
+        if np.any(merged[1:] == merged[:-1]):
+            raise ValueError("Account numbers must be unique!")
+        self.account_numbers = merged
+        self.balances_cents = np.concatenate([self.balances_cents, balances])[order]
+        if self.log is not None:
+            self.log.append(account_numbers, balances, OPEN)
+
+    def index_of(self, account_numbers):
+        """
+        Finds the position of each of <account_numbers> in the balance arrays.
+        Returns a tuple of the indices and a mask of which accounts exist.
+        The indices of missing accounts are meaningless.
+        """
+        account_numbers = np.asarray(account_numbers, dtype=np.int64)
+        indices = np.searchsorted(self.account_numbers, account_numbers)
+        indices = np.minimum(indices, max(len(self.account_numbers) - 1, 0))
+        if len(self.account_numbers) == 0:
+            return indices, np.zeros(account_numbers.shape, dtype=bool)
+        found = self.account_numbers[indices] == account_numbers
+        return indices, found
+
+    def balance(self, account_number: int):
+        """
+        Returns the balance of the account with <account_number>.
+        Raises a KeyError if there is no such account.
+        """
+        index, found = self.index_of(account_number)
+        if not found:
+            raise KeyError(account_number)
+        return from_cents(self.balances_cents[index].item())
+
+    def apply_transactions(
+        self, account_numbers, amounts, types, cents: bool = False
+    ) -> np.ndarray:
+        """
+        Applies a batch of deposits and withdrawals in order, as if each were made with
+        BankAccount.deposit or BankAccount.withdraw.
+        A transaction is rejected if its account does not exist, its amount is less than 0,
+        its type is unknown, or it is a withdrawal of more than the balance at that point.
+        Arguments:
+            account_numbers: the account of each transaction
+            amounts: the amount of each transaction
+            types: the type of each transaction, DEPOSIT or WITHDRAW
+            cents: bool, whether <amounts> are already whole numbers of cents,
+                which skips the conversion from amounts of money
+        Returns:
+            np.ndarray: a mask of the transactions that were accepted
+        """
+        account_numbers = np.asarray(account_numbers, dtype=np.int64).ravel()
+        amounts, valid = _amounts_to_cents(amounts, cents)
+        types = np.asarray(types).ravel()
+        if not (account_numbers.shape == amounts.shape == types.shape):
+            raise ValueError("The transaction arrays must all have the same length!")
+
+        # Sorting the transactions by account makes the lookup cache friendly,
+        # and groups the transactions of each account together in their original order
+        order = np.argsort(account_numbers, kind="stable")
+        indices = np.empty(len(order), dtype=np.int64)
+        accepted = np.empty(len(order), dtype=bool)
+        indices[order], accepted[order] = self.index_of(account_numbers[order])
+        accepted &= valid
+        accepted &= (types == DEPOSIT) | (types == WITHDRAW)
+        signed = np.where(types == WITHDRAW, -amounts, amounts)
+
+        # Rejecting a withdrawal raises the balance seen by the later ones, so only the first
+        # overdraft of each account is certain. Reject those and check the rest again,
+        # narrowing down to the accounts that were overdrawn each time.
+        positions = order[accepted[order]]
+        for _ in range(_VECTORIZED_REJECTION_ROUNDS):
+            if len(positions) == 0:
+                break
+            overdrawn = self._first_overdrafts(indices[positions], signed[positions])
+            if len(overdrawn) == 0:
+                positions = positions[:0]
+                break
+            accepted[positions[overdrawn]] = False
+            affected = np.isin(indices[positions], indices[positions[overdrawn]])
+            positions = positions[affected & accepted[positions]]
+
+        # Accounts still being overdrawn after many rounds are replayed one transaction at a time
+        balances = {}
+        for position, index in zip(positions.tolist(), indices[positions].tolist()):
+            balance = balances.get(index, self.balances_cents[index])
+            if balance + signed[position] < 0:
+                accepted[position] = False
+            else:
+                balances[index] = balance + signed[position]
+
+        np.add.at(self.balances_cents, indices[accepted], signed[accepted])
+        if self.log is not None:
+            self.log.append(
+                account_numbers[accepted], amounts[accepted], types[accepted]
+            )
+        return accepted
+
+    def save_snapshot(self, snapshot_path: str):
+        """
+        Writes every balance to <snapshot_path>, so recovery only replays the log from this point.
+        Commits the log first. The snapshot replaces any earlier one in a single rename.
+        """
+        offset = 0
+        if self.log is not None:
+            self.log.commit()
+            offset = self.log.offset
+        temporary_path = snapshot_path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(
+                _SNAPSHOT_HEADER.pack(
+                    _SNAPSHOT_MAGIC, offset, len(self.account_numbers)
+                )
+            )
+            file.write(self.account_numbers.astype("<i8").tobytes())
+            file.write(self.balances_cents.astype("<i8").tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, snapshot_path)
+
+    def _first_overdrafts(self, grouped, signed):
+        # The running balance of each account after each of its transactions,
+        # for transactions already grouped by account index
+        totals = np.cumsum(signed)
+        starts = np.ones(len(grouped), dtype=bool)
+        starts[1:] = grouped[1:] != grouped[:-1]
+        first = np.maximum.accumulate(np.where(starts, np.arange(len(grouped)), 0))
+        running = self.balances_cents[grouped] + totals - totals[first] + signed[first]
+        overdrawn = np.flatnonzero(running < 0)
+        # Keep only the first overdraft of each account
+        keep = np.ones(len(overdrawn), dtype=bool)
+        keep[1:] = grouped[overdrawn[1:]] != grouped[overdrawn[:-1]]
+        return overdrawn[keep]
+
+
+class TransactionLog:
+    """
+    An append-only binary log of the changes made to a Ledger, laid out as LOG_RECORD.
+    Records are written and synced to disk in groups: once <group_size> records are waiting,
+    every <group_interval> seconds from a background thread, or when commit is called.
+    Records that have not been committed are lost in a crash, so none is at risk for longer
+    than <group_interval>. Call close when done with the log, to stop the thread.
+    """
+
+    def __init__(
+        self, log_path: str, group_size: int = 4096, group_interval: float = 0.01
+    ):
+        """
+        Opens the log for appending, creating it if needed.
+        A partial record left at the end by a crash is removed.
+        Arguments:
+            log_path: str, the path of the log file
+            group_size: int, the number of records committed together
+            group_interval: float, the longest time in seconds a record waits to be committed,
+                            0 to commit every record as it is appended
+        """
+        if group_size <= 0:
+            raise ValueError(f"{group_size} is less than or equal to 0!")
+        if group_interval < 0:
+            raise ValueError(f"{group_interval} is less than 0!")
+        self.log_path = log_path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.file = open(log_path, "ab")
+        size = self.file.seek(0, os.SEEK_END)
+        self.offset = size - size % LOG_RECORD.itemsize
+        if self.offset != size:
+            self.file.truncate(self.offset)
+            self.file.seek(self.offset)
+        self._pending = []
+        self._pending_records = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._committer = None
+        if group_interval > 0:
+            self._committer = threading.Thread(
+                target=self._commit_periodically, daemon=True
+            )
+            self._committer.start()
+
+    def append(self, account_numbers, amounts, types):
+        """
+        Adds records to the log, committing them if a group is complete.
+        Arguments:
+            account_numbers: the account of each record
+            amounts: the amount of each record in cents
+            types: the type of each record, DEPOSIT, WITHDRAW or OPEN
+        """
+        account_numbers = np.asarray(account_numbers).ravel()
+        records = np.empty(len(account_numbers), dtype=LOG_RECORD)
+        records["account_number"] = account_numbers
+        records["amount_cents"] = amounts
+        records["type"] = types
+        with self._lock:
+            self._pending.append(records.tobytes())
+            self._pending_records += len(records)
+            commit = self._pending_records >= self.group_size or not self.group_interval
+        if commit:
+            self.commit()
+
+    def _commit_periodically(self):
+        while not self._closed.wait(self.group_interval):
+            if self._pending:
+                self.commit()
+
+    def emit(self, event):
+        """
+        Logs every change to a bank.BankAccount, so a log can be used as its sink and the
+        account recovered from it. A balance set directly is logged as the deposit or
+        withdrawal of the difference.
+        """
+        if event.kind == "open":
+            self.append(event.account_number, to_cents(event.amount), OPEN)
+        elif event.kind == "close":
+            self.append(event.account_number, 0, CLOSE)
+        elif event.kind == "adjust":
+            change = to_cents(event.amount)
+            self.append(
+                event.account_number, abs(change), DEPOSIT if change >= 0 else WITHDRAW
+            )
+        elif event.kind == "deposit":
+            self.append(event.account_number, to_cents(event.amount), DEPOSIT)
+        elif event.kind == "withdraw":
+            self.append(event.account_number, to_cents(event.amount), WITHDRAW)
+
+    def commit(self):
+        """
+        Writes every waiting record to the log and syncs it to disk.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            data = b"".join(self._pending)
+            self._pending = []
+            self._pending_records = 0
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.offset += len(data)
+
+    def close(self):
+        """
+        Commits every waiting record and closes the log.
+        """
+        self._closed.set()
+        if self._committer is not None:
+            self._committer.join()
+        self.commit()
+        self.file.close()
+
+
+def _replay_openings(recovered: Ledger, records, signed):
+    # Opens and closes the accounts of the OPEN and CLOSE records in <recovered>, and returns
+    # <signed> with the records that no longer count set to 0. Everything logged for an
+    # account up to its last CLOSE is dropped, then its first OPEN opens it with that balance.
+    # Any other OPEN, for an account that is already open, is a repeat and is ignored.
+    numbers = records["account_number"]
+    types = records["type"]
+    positions = np.arange(len(records))
+    # Only the accounts with OPEN or CLOSE records are looked at
+    accounts = np.unique(numbers[(types == OPEN) | (types == CLOSE)])
+    inverse = np.minimum(np.searchsorted(accounts, numbers), len(accounts) - 1)
+    involved = accounts[inverse] == numbers
+
+    closes = types == CLOSE
+    last_close = np.full(len(accounts), -1)
+    np.maximum.at(last_close, inverse[closes], positions[closes])
+    closed = accounts[last_close >= 0]
+    if len(closed):
+        keep = ~np.isin(recovered.account_numbers, closed)
+        recovered.account_numbers = np.array(recovered.account_numbers[keep])
+        recovered.balances_cents = np.array(recovered.balances_cents[keep])
+
+    live = ~involved | (positions > last_close[inverse])
+    opens = live & (types == OPEN)
+    first_open = np.full(len(accounts), len(records))
+    np.minimum.at(first_open, inverse[opens], positions[opens])
+    _, existing = recovered.index_of(accounts)
+    new = (first_open < len(records)) & ~existing
+    recovered.open_accounts(
+        accounts[new], records["amount_cents"][first_open[new]], cents=True
+    )
+    return np.where(live, signed, 0)
+
+
+def recover_ledger(snapshot_path: str, log_path: str, **log_options) -> Ledger:
+    """
+    Rebuilds a Ledger from its latest snapshot and the log written after it.
+    The snapshot is memory-mapped, so its pages are only read as they are used,
+    and the tail of the log is replayed in one vectorized pass.
+    Arguments:
+        snapshot_path: str, the path of the snapshot, which may not exist yet
+        log_path: str, the path of the transaction log
+        log_options: passed on to TransactionLog
+    Returns:
+        Ledger: the recovered ledger, which keeps writing to the log
+    """
+    recovered = Ledger()
+    offset = 0
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, "rb") as file:
+            magic, offset, count = _SNAPSHOT_HEADER.unpack(
+                file.read(_SNAPSHOT_HEADER.size)
+            )
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{snapshot_path} is not a ledger snapshot!")
+        if count > 0:
+            # Copy-on-write, so the ledger can change without touching the snapshot
+            recovered.account_numbers = np.memmap(
+                snapshot_path, "<i8", "c", _SNAPSHOT_HEADER.size, (count,)
+            )
+            recovered.balances_cents = np.memmap(
+                snapshot_path, "<i8", "c", _SNAPSHOT_HEADER.size + 8 * count, (count,)
+            )
+
+    log = TransactionLog(log_path, **log_options)
+    records = np.fromfile(log_path, dtype=LOG_RECORD, offset=offset)
+    records = records[: (log.offset - offset) // LOG_RECORD.itemsize]
+    numbers = records["account_number"]
+    types = records["type"]
+    signed = np.where(
+        types == WITHDRAW, -records["amount_cents"], records["amount_cents"]
+    )
+    signed[(types != DEPOSIT) & (types != WITHDRAW)] = 0
+    if np.any((types == OPEN) | (types == CLOSE)):
+        signed = _replay_openings(recovered, records, signed)
+    # Sorting by account keeps the lookups and the additions cache friendly
+    order = np.argsort(numbers, kind="stable")
+    indices, found = recovered.index_of(numbers[order])
+    np.add.at(recovered.balances_cents, indices[found], signed[order][found])
+    recovered.log = log
+    return recovered
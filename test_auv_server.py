@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+import unittest
+import numpy as np
+import auv_server
+import physics
+
+
+class TestAUVSimulationServer(unittest.IsolatedAsyncioTestCase):
+    def test_tick(self):
+        server = auv_server.AUVSimulationServer(np.pi / 4, 1, 1, time_step=0.1)
+        server.set_thrusters([10, 0, 0, 0])
+        for _ in range(2):
+            server.tick()
+        (times, x, y, theta, v, omega, a) = physics.simulate_auv2_motion(
+            np.array([10, 0, 0, 0]), np.pi / 4, 1, 1, time_step=0.1, time_final=0.3
+        )
+        self.assertAlmostEqual(server.state[0], times[2])
+        self.assertAlmostEqual(server.state[1], x[2])
+        self.assertAlmostEqual(server.state[3], theta[2])
+        self.assertRaises(ValueError, server.set_thrusters, [1, 2, 3])
+
+    def test_tick_duration(self):
+        server = auv_server.AUVSimulationServer(np.pi / 4, 1, 1)
+        server.set_thrusters([10, 5, 0, 0])
+        durations = []
+        for _ in range(200):
+            started = time.perf_counter()
+            server.tick()
+            durations.append(time.perf_counter() - started)
+        self.assertLess(np.median(durations), 0.001)
+
+    def test_max_thrust(self):
+        server = auv_server.AUVSimulationServer(np.pi / 4, 1, 1, max_thrust=5)
+        server.set_thrusters([10, -10, 1, 0])
+        np.testing.assert_array_equal(server.thrusters, np.array([5, -5, 1, 0]))
+
+    def test_backpressure(self):
+        server = auv_server.AUVSimulationServer(np.pi / 4, 1, 1, queue_size=2)
+        queue = asyncio.Queue(maxsize=server.queue_size)
+        server._subscribers.add(queue)
+        for _ in range(5):
+            server.tick()
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(server.dropped_states, 3)
+        # The newest states are kept
+        latest = json.loads(queue.get_nowait().decode())
+        self.assertAlmostEqual(latest["time"], 4 * server.time_step)
+
+    async def test_socket(self):
+        server = auv_server.AUVSimulationServer(np.pi / 4, 1, 1, time_step=0.005)
+        host, port = await server.start()
+        try:
+            clients = [await asyncio.open_connection(host, port) for _ in range(3)]
+            for _, writer in clients:
+                writer.write(b'{"subscribe": true}\n')
+            clients[0][1].write(b'{"thrusters": [10, 10, 0, 0]}\n')
+            for _, writer in clients:
+                await writer.drain()
+
+            for reader, _ in clients:
+                states = [
+                    json.loads(await asyncio.wait_for(reader.readline(), 1))
+                    for _ in range(20)
+                ]
+                times = [state["time"] for state in states]
+                self.assertEqual(times, sorted(times))
+            self.assertGreater(states[-1]["x"], 0)
+
+            reader, writer = clients[0]
+            writer.write(b'{"thrusters": [1]}\n')
+            await writer.drain()
+            while True:
+                message = json.loads(await asyncio.wait_for(reader.readline(), 1))
+                if "error" in message:
+                    break
+
+            for _, writer in clients:
+                writer.close()
+                await writer.wait_closed()
+        finally:
+            await server.stop()
+
+    async def test_stop_disconnects_clients(self):
+        server = auv_server.AUVSimulationServer(np.pi / 4, 1, 1, time_step=0.005)
+        host, port = await server.start()
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(b'{"subscribe": true}\n')
+        await writer.drain()
+        await asyncio.wait_for(reader.readline(), 1)
+
+        await asyncio.wait_for(server.stop(), 1)
+        self.assertEqual(len(server._subscribers), 0)
+        self.assertEqual(len(server._clients), 0)
+        # The connection is closed, so the client reads to the end of the stream
+        while await asyncio.wait_for(reader.readline(), 1):
+            pass
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
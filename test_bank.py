@@ -1,3 +1,11 @@
+import contextlib
+import decimal
+import io
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
 import bank
 
@@ -18,6 +26,7 @@ class TestBank(unittest.TestCase):
         account = bank.BankAccount("Jane Doe", 5678, 1000.0)
         self.assertRaises(ValueError, account.withdraw, 100000)
         self.assertRaises(ValueError, account.withdraw, -1)
+        self.assertRaises(ValueError, account.withdraw, -0.004)
         account.withdraw(1000)
         self.assertEqual(account.balance, 0)
         self.assertNotEqual(account.balance, -1000)
@@ -31,11 +40,328 @@ class TestBank(unittest.TestCase):
         self.assertEquals(account.balance, 500)
         self.assertRaises(TypeError, account.deposit, "bar")
         self.assertRaises(ValueError, account.deposit, -1)
+        self.assertRaises(ValueError, account.deposit, -0.001)
+        # Fractions of a cent are rounded
+        account.deposit(0.004)
+        self.assertEqual(account.balance, 500)
+
+    def test_apply_batch(self):
+        sink = bank.RingBufferSink()
+        account = bank.BankAccount("John Doe", 1234, 10, sink=sink)
+        results = account.apply_batch(
+            [("withdraw", 4), ("withdraw", 10), ("deposit", 0.5), ("deposit", "foo"), ("transfer", 1)]
+        )
+        self.assertEqual(results[:3:2], [6, 6.5])
+        self.assertIsInstance(results[1], ValueError)
+        self.assertIsInstance(results[3], TypeError)
+        self.assertIsInstance(results[4], ValueError)
+        self.assertEqual(account.balance, 6.5)
+        self.assertEqual(
+            [(event.kind, event.amount, event.balance) for event in list(sink.events)[1:]],
+            [("withdraw", 4, 6), ("deposit", 0.5, 6.5)],
+        )
 
     def test_print_balance(self):
         account = bank.BankAccount("John Doe", 500.00, 9012)
         self.assertIsNone(account.print_balance())
         self.assertNotEquals(account.print_balance(), 500.00)
 
+    def test_concurrent_withdraw(self):
+        account = bank.BankAccount("Jane Doe", 5678, 100)
+        successes = []
+
+        def worker():
+            for _ in range(50):
+                try:
+                    account.withdraw(1)
+                    successes.append(1)
+                except ValueError:
+                    pass
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(account.balance, 0)
+        self.assertEqual(len(successes), 100)
+
+    def test_account_locks(self):
+        locks = bank.AccountLocks(4)
+        self.assertIs(locks.lock_for(1), locks.lock_for(5))
+        self.assertIsNot(locks.lock_for(1), locks.lock_for(2))
+        account = locks.open_account("John Doe", 1234, 10)
+        self.assertIs(account.lock, locks.lock_for(1234))
+        self.assertRaises(ValueError, bank.AccountLocks, 0)
+
+    def test_transfer(self):
+        locks = bank.AccountLocks(4)
+        first = locks.open_account("John Doe", 1, 1000)
+        second = locks.open_account("Jane Doe", 2, 1000)
+        same_stripe = locks.open_account("Lorem Ipsum", 5, 1000)
+
+        def worker(source, destination):
+            for _ in range(100):
+                bank.transfer(source, destination, 1)
+
+        threads = [
+            threading.Thread(target=worker, args=(first, second)),
+            threading.Thread(target=worker, args=(second, first)),
+            threading.Thread(target=worker, args=(first, same_stripe)),
+            threading.Thread(target=worker, args=(same_stripe, first)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(first.balance + second.balance + same_stripe.balance, 3000)
+
+        self.assertRaises(ValueError, bank.transfer, first, second, 100000)
+        self.assertRaises(ValueError, bank.transfer, first, second, -1)
+        self.assertEqual(first.balance + second.balance + same_stripe.balance, 3000)
+
+    def test_print_sink(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            account = bank.BankAccount("John Doe", 1234, 10)
+            account.deposit(5)
+            account.withdraw(3)
+            account.print_balance()
+        self.assertEqual(
+            output.getvalue().splitlines(),
+            [
+                "You have deposited 5 to your account.",
+                "You have successfully withdrawn 3 from your account.",
+                "Your current balance is 12.0.",
+            ],
+        )
+
+    def test_null_sink(self):
+        account = bank.BankAccount("John Doe", 1234, 10, sink=bank.NullSink())
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            account.deposit(5)
+            account.print_balance()
+        self.assertEqual(output.getvalue(), "")
+
+    def test_ring_buffer_sink(self):
+        sink = bank.RingBufferSink(2)
+        account = bank.BankAccount("John Doe", 1234, 10, sink=sink)
+        account.deposit(5)
+        account.withdraw(3)
+        self.assertRaises(ValueError, account.withdraw, 100)
+        account.print_balance()
+        self.assertEqual(
+            [(event.kind, event.amount, event.balance) for event in sink.events],
+            [("withdraw", 3, 12), ("balance", 0, 12)],
+        )
+        self.assertEqual(sink.events[0].account_number, 1234)
+        self.assertRaises(ValueError, bank.RingBufferSink, 0)
+
+    def test_batched_file_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "events.tsv")
+            sink = bank.BatchedFileSink(path, flush_every=3, flush_interval=60)
+            account = bank.BankAccount("John Doe", 1234, 10, sink=sink)
+            account.deposit(1)
+            with open(path) as file:
+                self.assertEqual(file.read(), "")
+            account.withdraw(3)
+            with open(path) as file:
+                lines = file.read().splitlines()
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(lines[0].split("\t")[1:], ["open", "1234", "10", "10.0"])
+            self.assertEqual(lines[2].split("\t")[1:], ["withdraw", "1234", "3", "8.0"])
+            account.deposit(4)
+            sink.close()
+            with open(path) as file:
+                self.assertEqual(len(file.read().splitlines()), 4)
+
+        file = io.StringIO()
+        sink = bank.BatchedFileSink(file, flush_every=100, flush_interval=0)
+        bank.BankAccount("John Doe", 1234, 10, sink=sink).deposit(1)
+        self.assertEqual(len(file.getvalue().splitlines()), 2)
+        self.assertRaises(ValueError, bank.BatchedFileSink, file, 0)
+
+    def test_batched_file_sink_interval(self):
+        # The last events of a burst are written without waiting for another event
+        file = io.StringIO()
+        sink = bank.BatchedFileSink(file, flush_every=100, flush_interval=0.02)
+        account = bank.BankAccount("John Doe", 1234, 10, sink=sink)
+        account.deposit(1)
+        account.deposit(2)
+        deadline = time.monotonic() + 2
+        while not file.getvalue() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(file.getvalue().splitlines()), 3)
+        sink.close()
+        self.assertFalse(sink._flusher.is_alive())
+
+    def test_slots(self):
+        account = bank.BankAccount("John Doe", 1234, 10)
+        self.assertFalse(hasattr(account, "__dict__"))
+        with self.assertRaises(AttributeError):
+            account.nickname = "JD"
+
+    def test_account_registry(self):
+        registry = bank.AccountRegistry(stripes=4, sink=bank.NullSink())
+        john = registry.open_account("John Doe", 30, 100)
+        jane = registry.open_account("Jane Doe", 10)
+        other_john = registry.open_account("John Doe", 20, 5)
+        self.assertRaises(ValueError, registry.open_account, "Lorem Ipsum", 10)
+
+        self.assertEqual(len(registry), 3)
+        self.assertIs(registry[30], john)
+        self.assertIn(10, registry)
+        self.assertNotIn(40, registry)
+        self.assertRaises(KeyError, registry.__getitem__, 40)
+        self.assertIs(john.lock, registry.locks.lock_for(30))
+        self.assertEqual(registry.find_by_name("John Doe"), [john, other_john])
+        self.assertEqual(registry.find_by_name("foobar"), [])
+
+        self.assertEqual(list(registry), [jane, other_john, john])
+        self.assertEqual(registry.accounts_in_range(15, 30), [other_john])
+        self.assertEqual(registry.accounts_in_range(low=20), [other_john, john])
+        self.assertEqual(registry.accounts_in_range(high=20), [jane])
+
+        usage = registry.memory_usage()
+        self.assertGreater(usage, 0)
+        self.assertIs(registry.close_account(30), john)
+        self.assertNotIn(30, registry)
+        self.assertEqual(registry.find_by_name("John Doe"), [other_john])
+        self.assertEqual(list(registry), [jane, other_john])
+        self.assertLess(registry.memory_usage(), usage)
+        self.assertRaises(KeyError, registry.close_account, 30)
+        registry.close_account(10)
+        self.assertEqual(registry.find_by_name("Jane Doe"), [])
+
+        # Names shared by several accounts keep the order the accounts were opened in
+        third_john = registry.open_account("John Doe", 40)
+        fourth_john = registry.open_account("John Doe", 50)
+        registry.close_account(40)
+        self.assertEqual(registry.find_by_name("John Doe"), [other_john, fourth_john])
+        registry.close_account(20)
+        self.assertEqual(registry.find_by_name("John Doe"), [fourth_john])
+        self.assertIsNot(third_john, fourth_john)
+
+    def test_account_registry_duplicate(self):
+        # A rejected account is never created, so its sink hears nothing about it
+        sink = bank.RingBufferSink()
+        registry = bank.AccountRegistry(sink=sink)
+        registry.open_account("A", 1, 100)
+        self.assertRaises(ValueError, registry.open_account, "B", 1, 50)
+        self.assertEqual([event.kind for event in sink.events], ["open"])
+        self.assertEqual(registry.find_by_name("B"), [])
+
+    def test_account_registry_memory(self):
+        # Compared with the original accounts, each with an attribute dict, kept in a dict by
+        # number, with a dict from name to number for the same lookups as the registry
+        class PlainAccount:
+            def __init__(self, name, account_number, balance):
+                self.name = name
+                self.balance = balance
+                self.account_number = account_number
+
+        count = 20000
+        names = [f"Customer {i}" for i in range(count)]
+        balances = [i + 0.5 for i in range(count)]
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            accounts = {i: PlainAccount(names[i], i, balances[i]) for i in range(count)}
+            by_name = {names[i]: i for i in range(count)}
+            baseline = tracemalloc.get_traced_memory()[0] - start
+            del accounts, by_name
+
+            start = tracemalloc.get_traced_memory()[0]
+            registry = bank.AccountRegistry(sink=bank.NullSink())
+            for i in range(count):
+                registry.open_account(names[i], i, balances[i])
+            used = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+        self.assertLess(used, baseline)
+        # The estimate counts the names but not the balances, which come to about the same
+        self.assertLess(abs(registry.memory_usage() - used), used / 4)
+
+    def test_cents(self):
+        self.assertEqual(bank.to_cents(12.34), 1234)
+        self.assertEqual(bank.to_cents(5), 500)
+        self.assertEqual(bank.to_cents(decimal.Decimal("0.07")), 7)
+        self.assertEqual(bank.from_cents(1234), 12.34)
+        self.assertRaises(TypeError, bank.to_cents, "12.34")
+
+        account = bank.BankAccount("John Doe", 1234, 0, sink=bank.NullSink())
+        for _ in range(1000):
+            account.deposit(0.1)
+        self.assertEqual(account.balance_cents, 10000)
+        self.assertEqual(account.balance, 100)
+        for _ in range(1000):
+            account.withdraw(0.1)
+        self.assertEqual(account.balance, 0)
+        account.balance = 2.5
+        self.assertEqual(account.balance_cents, 250)
+
+    def test_balance_history(self):
+        history = bank.BalanceHistory()
+        for timestamp, cents in [(10, 0), (15, 500), (25, 300), (26, 100), (40, 900)]:
+            history.record(timestamp, cents)
+        history.record(39, 1000)
+        self.assertEqual(len(history), 6)
+        self.assertIsNone(history.balance_at(9))
+        self.assertEqual(history.balance_at(10), 0)
+        self.assertEqual(history.balance_at(24.9), 5)
+        self.assertEqual(history.balance_at(25.5), 3)
+        self.assertEqual(history.balance_at(40), 10)
+
+        history.compact(before=30, resolution=10)
+        self.assertEqual(list(history.timestamps), [10, 15, 26, 40, 40])
+        self.assertEqual(history.balance_at(10), 0)
+        self.assertEqual(history.balance_at(20), 5)
+        self.assertEqual(history.balance_at(27), 1)
+        self.assertEqual(history.balance_at(100), 10)
+        history.record(50, 0)
+        self.assertEqual(history.balance_at(50), 0)
+        self.assertRaises(ValueError, history.compact, 30, 0)
+
+        # The first balance is kept, so the account does not seem to be opened later
+        history = bank.BalanceHistory()
+        history.record(0, 1000)
+        history.record(3000, 2000)
+        history.compact(before=4000, resolution=3600)
+        self.assertEqual(history.balance_at(100), 10)
+        self.assertEqual(history.balance_at(3000), 20)
+
+    def test_account_history(self):
+        account = bank.BankAccount("John Doe", 1234, 10, sink=bank.NullSink())
+        self.assertIsNone(account.history)
+        self.assertRaises(ValueError, account.balance_at, time.time())
+
+        registry = bank.AccountRegistry(sink=bank.NullSink(), keep_history=True)
+        opened = time.time()
+        first = registry.open_account("John Doe", 1, 10)
+        second = registry.open_account("Jane Doe", 2)
+        first.deposit(5)
+        first.withdraw(12)
+        self.assertRaises(ValueError, first.withdraw, 100)
+        bank.transfer(first, second, 3)
+        self.assertEqual(len(first.history), 4)
+        self.assertEqual(first.history.balances_cents.tolist(), [1000, 1500, 300, 0])
+        self.assertIsNone(first.balance_at(opened - 1))
+        self.assertEqual(first.balance_at(time.time()), 0)
+        self.assertEqual(registry.balances_at(time.time()), {1: 0, 2: 3})
+        self.assertEqual(registry.balances_at(opened - 1), {})
+        self.assertEqual(registry.balances_at(time.time(), [2]), {2: 3})
+
+        opened = first.history.timestamps[0]
+        registry.compact_histories(time.time() + 1, 3600)
+        self.assertLessEqual(len(first.history), 3)
+        self.assertEqual(first.balance_at(opened), 10)
+        self.assertEqual(registry.balances_at(opened, [1]), {1: 10})
+        self.assertEqual(first.balance_at(time.time()), 0)
+        self.assertRaises(ValueError, bank.AccountRegistry().balances_at, 0)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
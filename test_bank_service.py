@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+import bank
+import bank_service
+
+
+class TestAccountService(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sink = bank.RingBufferSink()
+        self.registry = bank.AccountRegistry(sink=self.sink)
+        self.registry.open_account("John Doe", 1, 100)
+        self.registry.open_account("Jane Doe", 2, 0)
+        self.service = bank_service.AccountService(self.registry, window=0.01)
+
+    async def test_batching(self):
+        results = await asyncio.gather(
+            self.service.withdraw(1, 60),
+            self.service.deposit(2, 10),
+            self.service.withdraw(1, 60),
+            self.service.deposit(1, 20),
+            self.service.withdraw(1, 60),
+            self.service.withdraw(3, 1),
+            return_exceptions=True,
+        )
+        self.assertEqual(results[0], 40)
+        self.assertEqual(results[1], 10)
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual(results[3], 60)
+        self.assertEqual(results[4], 0)
+        self.assertIsInstance(results[5], KeyError)
+        self.assertEqual(self.service.batches, 1)
+        self.assertEqual(self.registry[1].balance, 0)
+        self.assertEqual(self.registry[2].balance, 10)
+        self.assertEqual(
+            [
+                (event.kind, event.account_number, event.balance)
+                for event in self.sink.events
+                if event.kind != "open"
+            ],
+            [
+                ("withdraw", 1, 40),
+                ("deposit", 1, 60),
+                ("withdraw", 1, 0),
+                ("deposit", 2, 10),
+            ],
+        )
+
+    async def test_max_batch(self):
+        service = bank_service.AccountService(self.registry, window=60, max_batch=3)
+        results = await asyncio.gather(*(service.deposit(2, 1) for _ in range(6)))
+        self.assertEqual(results, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(service.batches, 2)
+
+    async def test_invalid(self):
+        with self.assertRaises(ValueError):
+            await self.service.deposit(1, -1)
+        with self.assertRaises(ValueError):
+            await self.service.withdraw(1, -0.001)
+        with self.assertRaises(TypeError):
+            await self.service.withdraw(1, "foo")
+        self.assertRaises(ValueError, bank_service.AccountService, self.registry, -1)
+        self.assertRaises(
+            ValueError, bank_service.AccountService, self.registry, 0.1, 0
+        )
+
+    async def test_failing_sink(self):
+        class FailingSink:
+            def emit(self, event):
+                if event.kind == "withdraw":
+                    raise OSError("The disk is full")
+
+        registry = bank.AccountRegistry(sink=FailingSink())
+        registry.open_account("John Doe", 1, 100)
+        registry.open_account("Jane Doe", 2, 0)
+        service = bank_service.AccountService(registry, window=0.01)
+        results = await asyncio.wait_for(
+            asyncio.gather(
+                service.withdraw(1, 30),
+                service.deposit(1, 5),
+                service.deposit(2, 10),
+                return_exceptions=True,
+            ),
+            1,
+        )
+        self.assertIsInstance(results[0], OSError)
+        self.assertEqual(results[1:], [75, 10])
+        self.assertEqual(registry[1].balance, 75)
+        self.assertEqual(registry[2].balance, 10)
+
+    async def test_concurrent_callers(self):
+        async def caller():
+            for _ in range(10):
+                await self.service.withdraw(1, 1)
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(caller() for _ in range(10)))
+        self.assertEqual(self.registry[1].balance, 0)
+        self.assertLess(self.service.batches, 100)
+
+    async def test_history(self):
+        registry = bank.AccountRegistry(sink=bank.NullSink(), keep_history=True)
+        registry.open_account("John Doe", 1, 100)
+        service = bank_service.AccountService(registry)
+        await asyncio.gather(service.withdraw(1, 30), service.deposit(1, 5))
+        self.assertEqual(
+            registry[1].history.balances_cents.tolist(), [10000, 7000, 7500]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -84,6 +84,157 @@ class TestHello(unittest.TestCase):
         self.assertNotEqual(hello.cot(0), 1)
         self.assertRaises(TypeError, hello.cot, "foo")
 
+    def test_arrays(self):
+        a = np.array([1.0, 2.0, 4.0])
+        b = np.array([2.0, 0.0, 8.0])
+        np.testing.assert_array_equal(hello.add(a, b), np.array([3.0, 2.0, 12.0]))
+        np.testing.assert_array_equal(hello.sub(a, b), np.array([-1.0, 2.0, -4.0]))
+        np.testing.assert_array_equal(hello.mul(a, b), np.array([2.0, 0.0, 32.0]))
+        np.testing.assert_array_equal(hello.sqrt(a), np.array([1.0, np.sqrt(2), 2.0]))
+        np.testing.assert_array_almost_equal(hello.cot(a), 1 / np.tan(a))
+
+    def test_out(self):
+        x = np.linspace(0.1, 1, 5)
+        buffer = np.empty_like(x)
+        result = hello.add(
+            hello.mul(hello.sin(x), hello.cos(x), out=buffer), 1, out=buffer
+        )
+        self.assertIs(result, buffer)
+        np.testing.assert_array_almost_equal(buffer, np.sin(x) * np.cos(x) + 1)
+        self.assertIs(hello.cot(x, out=buffer), buffer)
+        np.testing.assert_array_almost_equal(buffer, 1 / np.tan(x))
+        self.assertIs(hello.exp(x, out=buffer), buffer)
+        self.assertIs(hello.log(x, out=buffer), buffer)
+        self.assertIs(hello.power(x, 2, out=buffer), buffer)
+        np.testing.assert_array_almost_equal(buffer, x**2)
+
+    def test_where(self):
+        x = np.array([4.0, -1.0, 9.0])
+        buffer = np.zeros(3)
+        hello.sqrt(x, out=buffer, where=x >= 0)
+        np.testing.assert_array_equal(buffer, np.array([2.0, 0.0, 3.0]))
+
+    def test_dtype(self):
+        x = np.arange(4)
+        self.assertEqual(hello.sin(x, dtype=np.float32).dtype, np.float32)
+        self.assertEqual(hello.add(x, x, dtype=np.float32).dtype, np.float32)
+        self.assertEqual(hello.div(x, 2, dtype=np.float32).dtype, np.float32)
+
+    def test_div_arrays(self):
+        a = np.array([1.0, 2.0, 3.0])
+        b = np.array([2.0, 0.0, 4.0])
+        self.assertRaises(ValueError, hello.div, a, b)
+        np.testing.assert_array_equal(
+            hello.div(a, b, zero_division=np.nan), np.array([0.5, np.nan, 0.75])
+        )
+        np.testing.assert_array_equal(
+            hello.div(a, b, zero_division=0), np.array([0.5, 0.0, 0.75])
+        )
+        # Divisors that are masked out do not count
+        buffer = np.full(3, -1.0)
+        hello.div(a, b, out=buffer, where=b != 0)
+        np.testing.assert_array_equal(buffer, np.array([0.5, -1.0, 0.75]))
+        self.assertEqual(hello.div(1, 0, zero_division=np.inf), np.inf)
+        self.assertEqual(hello.div(1, 4, zero_division=0), 0.25)
+        np.testing.assert_array_equal(
+            hello.div(np.arange(3), np.array([1, 0, 2]), zero_division=-1),
+            np.array([0, -1, 1]),
+        )
+        np.testing.assert_array_equal(
+            hello.div([1, 2], [0, 1], zero_division=0), np.array([0.0, 2.0])
+        )
+
+    def test_lazy(self):
+        x = np.linspace(0.1, 3, 10001)
+        y = np.linspace(-2, 2, 10001)
+        expected = np.sin(x) * np.cos(x) + np.exp(y) / np.sqrt(x)
+        with hello.lazy():
+            expression = hello.add(
+                hello.mul(hello.sin(x), hello.cos(x)),
+                hello.div(hello.exp(y), hello.sqrt(x)),
+            )
+        self.assertIsInstance(expression, hello.Expression)
+        self.assertEqual(expression.shape, x.shape)
+        for chunk_size, workers in [(10**6, 1), (1000, 1), (999, 4)]:
+            np.testing.assert_allclose(
+                expression.evaluate(chunk_size=chunk_size, workers=workers), expected
+            )
+        out = np.empty_like(x)
+        self.assertIs(expression.evaluate(out, chunk_size=64), out)
+        np.testing.assert_allclose(out, expected)
+        np.testing.assert_allclose(np.asarray(expression), expected)
+        self.assertRaises(ValueError, expression.evaluate, np.empty(3))
+        self.assertRaises(ValueError, expression.evaluate, chunk_size=0)
+
+    def test_workers(self):
+        x = np.linspace(0.1, 1.5, 100001)
+        for function, reference in [
+            (hello.sin, np.sin),
+            (hello.cos, np.cos),
+            (hello.tan, np.tan),
+            (hello.log, np.log),
+            (hello.exp, np.exp),
+        ]:
+            np.testing.assert_array_equal(
+                function(x, workers=4, chunk_size=1000), reference(x)
+            )
+        np.testing.assert_allclose(hello.cot(x, workers=None), 1 / np.tan(x))
+        out = np.empty(x.shape, dtype=np.float32)
+        self.assertIs(hello.power(x, 2, out=out, workers=3, dtype=np.float32), out)
+        np.testing.assert_allclose(out, x**2, rtol=1e-6)
+        self.assertEqual(hello.sin(0, workers=2), 0)
+        self.assertRaises(ValueError, hello.sin, x, workers=0)
+        with hello.lazy():
+            self.assertRaises(ValueError, hello.sin, x, workers=2)
+
+    def test_lazy_chunks(self):
+        # Lists are cut into chunks like arrays
+        with hello.lazy():
+            expression = hello.add(np.arange(40000.0), list(range(40000)))
+        np.testing.assert_array_equal(expression.evaluate(), np.arange(40000.0) * 2)
+        # Wide rows are split, and every chunk of a broadcast input is a view of it
+        a = np.linspace(0, 1, 2 * 50000).reshape(2, 50000)
+        b = np.linspace(1, 2, 50000)
+        with hello.lazy():
+            expression = hello.mul(hello.sin(a), hello.exp(b))
+        np.testing.assert_allclose(
+            expression.evaluate(chunk_size=1000, workers=3), np.sin(a) * np.exp(b)
+        )
+        chunks = list(hello._chunk_indices(a.shape, 1000))
+        self.assertEqual(len(chunks), 100)
+        self.assertTrue(all(a[chunk].size <= 1000 for chunk in chunks))
+        with hello.lazy():
+            empty = hello.sin(np.empty((0, 3))).evaluate()
+        self.assertEqual(empty.shape, (0, 3))
+
+    def test_lazy_chaining(self):
+        # Helpers given an Expression build one too, outside of a lazy() block
+        a = np.arange(12, dtype=np.float32).reshape(4, 3)
+        b = np.array([1.0, 2.0, 0.0], dtype=np.float32)
+        with hello.lazy():
+            squared = hello.power(a, 2)
+        expression = hello.sub(squared, hello.div(squared, b, zero_division=0))
+        self.assertIsInstance(expression, hello.Expression)
+        self.assertRaises(ValueError, hello.add, squared, 1, out=np.empty((4, 3)))
+        result = expression.evaluate(chunk_size=3)
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_allclose(
+            result, a**2 - np.divide(a**2, b, out=np.zeros_like(a), where=b != 0)
+        )
+        with hello.lazy():
+            self.assertEqual(
+                hello.sin(a, dtype=np.float64).evaluate().dtype, np.float64
+            )
+        # Scalars and masks are evaluated too
+        with hello.lazy():
+            self.assertAlmostEqual(
+                hello.cot(hello.add(0.5, 0.5)).evaluate(), 1 / np.tan(1)
+            )
+            expression = hello.log(a, where=a > 0, out=None)
+        out = np.full(a.shape, -1.0, dtype=np.float32)
+        expression.evaluate(out, chunk_size=1)
+        self.assertEqual(out[0, 0], -1)
+        np.testing.assert_allclose(out[a > 0], np.log(a[a > 0]))
 
 
 if __name__ == "__main__":
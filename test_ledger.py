@@ -0,0 +1,260 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+import bank
+import ledger
+
+
+class TestLedger(unittest.TestCase):
+    def test_open_accounts(self):
+        accounts = ledger.Ledger([30, 10], [5, 0])
+        accounts.open_accounts([20])
+        self.assertEqual(len(accounts), 3)
+        np.testing.assert_array_equal(accounts.account_numbers, np.array([10, 20, 30]))
+        self.assertEqual(accounts.balance(30), 5)
+        self.assertEqual(accounts.balance(20), 0)
+        self.assertRaises(KeyError, accounts.balance, 40)
+        self.assertRaises(ValueError, accounts.open_accounts, [10])
+        self.assertRaises(ValueError, accounts.open_accounts, [50, 50])
+        self.assertRaises(ValueError, accounts.open_accounts, [60], [-1])
+        self.assertRaises(KeyError, ledger.Ledger().balance, 1)
+
+    def test_apply_transactions(self):
+        accounts = ledger.Ledger([1, 2, 3], [100, 0, 50])
+        accepted = accounts.apply_transactions(
+            [1, 2, 2, 3, 4, 1, 2, 3],
+            [30, 10, 20, 60, 10, -5, 5, 50],
+            [
+                ledger.WITHDRAW,
+                ledger.DEPOSIT,
+                ledger.WITHDRAW,
+                ledger.WITHDRAW,
+                ledger.DEPOSIT,
+                ledger.DEPOSIT,
+                ledger.WITHDRAW,
+                ledger.WITHDRAW,
+            ],
+        )
+        np.testing.assert_array_equal(
+            accepted, np.array([True, True, False, False, False, False, True, True])
+        )
+        self.assertEqual(accounts.balance(1), 70)
+        self.assertEqual(accounts.balance(2), 5)
+        self.assertEqual(accounts.balance(3), 0)
+        self.assertRaises(
+            ValueError, accounts.apply_transactions, [1, 2], [1], [ledger.DEPOSIT]
+        )
+        self.assertEqual(len(accounts.apply_transactions([], [], [])), 0)
+
+    def test_apply_transactions_matches_bank_account(self):
+        rng = np.random.default_rng(0)
+        numbers = np.arange(20)
+        starting = rng.integers(0, 50, len(numbers))
+        transactions = (
+            rng.integers(0, 22, 5000),
+            rng.integers(0, 30, 5000),
+            rng.integers(0, 2, 5000),
+        )
+        accounts = ledger.Ledger(numbers, starting)
+        accepted = accounts.apply_transactions(*transactions)
+
+        expected = []
+        reference = [bank.BankAccount("", n, int(b)) for n, b in zip(numbers, starting)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for number, amount, kind in zip(*transactions):
+                if number >= len(reference):
+                    expected.append(False)
+                    continue
+                account = reference[number]
+                try:
+                    if kind == ledger.DEPOSIT:
+                        account.deposit(amount)
+                    else:
+                        account.withdraw(amount)
+                    expected.append(True)
+                except ValueError:
+                    expected.append(False)
+        np.testing.assert_array_equal(accepted, np.array(expected))
+        np.testing.assert_array_equal(
+            accounts.balances_cents,
+            np.array([account.balance_cents for account in reference]),
+        )
+
+    def test_recover_ledger(self):
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = os.path.join(directory, "ledger.snapshot")
+            log_path = os.path.join(directory, "ledger.log")
+            accounts = ledger.recover_ledger(snapshot_path, log_path, group_size=2)
+            self.assertEqual(len(accounts), 0)
+            accounts.open_accounts([1, 2, 3], [100, 0, 50])
+            accounts.apply_transactions(
+                [1, 2, 3],
+                [30, 10, 60],
+                [ledger.WITHDRAW, ledger.DEPOSIT, ledger.WITHDRAW],
+            )
+            accounts.save_snapshot(snapshot_path)
+            accounts.open_accounts([4], [7])
+            accounts.apply_transactions(
+                [4, 1], [2, 5], [ledger.WITHDRAW, ledger.DEPOSIT]
+            )
+            accounts.log.commit()
+            expected = accounts.balances_cents.copy()
+            # Uncommitted records are lost, and so is a torn record at the end of the log.
+            # The crash stops the background commits first
+            accounts.log._closed.set()
+            accounts.log._committer.join()
+            accounts.log.group_size = 100
+            accounts.apply_transactions([1], [1], [ledger.DEPOSIT])
+            accounts.log.file.write(b"torn")
+            accounts.log.file.close()
+
+            recovered = ledger.recover_ledger(snapshot_path, log_path)
+            np.testing.assert_array_equal(
+                recovered.account_numbers, np.array([1, 2, 3, 4])
+            )
+            np.testing.assert_array_equal(recovered.balances_cents, expected)
+            self.assertEqual(os.path.getsize(log_path) % ledger.LOG_RECORD.itemsize, 0)
+
+            # The recovered ledger keeps logging, without changing the snapshot
+            recovered.apply_transactions([2], [10], [ledger.WITHDRAW])
+            recovered.log.close()
+            recovered = ledger.recover_ledger(snapshot_path, log_path)
+            self.assertEqual(recovered.balance(2), 0)
+            self.assertEqual(recovered.balance(4), 5)
+            recovered.log.close()
+
+            with open(snapshot_path, "wb") as file:
+                file.write(b"x" * 64)
+            self.assertRaises(
+                ValueError, ledger.recover_ledger, snapshot_path, log_path
+            )
+
+    def test_transaction_log_sink(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "account.log")
+            log = ledger.TransactionLog(log_path, group_size=1)
+            account = bank.BankAccount("John Doe", 1234, 100, sink=log)
+            account.deposit(10)
+            account.withdraw(4)
+            account.print_balance()
+            log.close()
+            records = np.fromfile(log_path, dtype=ledger.LOG_RECORD)
+            self.assertEqual(
+                records["type"].tolist(), [ledger.OPEN, ledger.DEPOSIT, ledger.WITHDRAW]
+            )
+            self.assertEqual(records["amount_cents"].tolist(), [10000, 1000, 400])
+            recovered = ledger.recover_ledger(
+                os.path.join(directory, "missing"), log_path
+            )
+            self.assertEqual(recovered.balance(1234), account.balance)
+            recovered.log.close()
+        self.assertRaises(ValueError, ledger.TransactionLog, log_path, 0)
+
+    def test_transaction_log_registry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "accounts.log")
+            log = ledger.TransactionLog(log_path, group_size=1)
+            registry = bank.AccountRegistry(sink=log)
+            registry.open_account("A", 1, 100)
+            self.assertRaises(ValueError, registry.open_account, "B", 1, 50)
+            registry.open_account("C", 7, 20)
+            registry[7].withdraw(5)
+            registry.close_account(7)
+            registry.open_account("D", 7, 3)
+            registry[7].deposit(1)
+            registry[1].deposit(10)
+            # A balance set directly is logged as the difference
+            registry[1].balance = 51
+            registry.open_account("E", 8, 0).balance = 2.5
+            log.close()
+
+            recovered = ledger.recover_ledger(
+                os.path.join(directory, "missing"), log_path
+            )
+            for account in registry:
+                self.assertEqual(
+                    recovered.balance(account.account_number), account.balance
+                )
+            self.assertEqual(len(recovered), len(registry))
+            recovered.log.close()
+
+            # Closing for good removes the account, and a repeated OPEN is ignored
+            log = ledger.TransactionLog(log_path, group_size=1)
+            log.append([8, 1], [0, 999], [ledger.CLOSE, ledger.OPEN])
+            log.close()
+            recovered = ledger.recover_ledger(
+                os.path.join(directory, "missing"), log_path
+            )
+            self.assertRaises(KeyError, recovered.balance, 8)
+            self.assertEqual(recovered.balance(1), 51)
+            recovered.log.close()
+
+            # An account from the snapshot that is closed and opened again starts over
+            snapshot_path = os.path.join(directory, "ledger.snapshot")
+            log_path = os.path.join(directory, "ledger.log")
+            accounts = ledger.recover_ledger(snapshot_path, log_path)
+            accounts.open_accounts([1, 2], [10, 20])
+            accounts.save_snapshot(snapshot_path)
+            accounts.apply_transactions([2], [5], [ledger.DEPOSIT])
+            accounts.log.append(
+                [2, 2, 2], [0, 700, 100], [ledger.CLOSE, ledger.OPEN, ledger.DEPOSIT]
+            )
+            accounts.log.close()
+            recovered = ledger.recover_ledger(snapshot_path, log_path)
+            np.testing.assert_array_equal(recovered.account_numbers, np.array([1, 2]))
+            self.assertEqual(recovered.balance(1), 10)
+            self.assertEqual(recovered.balance(2), 8)
+            recovered.log.close()
+
+    def test_transaction_log_interval(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "ledger.log")
+            log = ledger.TransactionLog(log_path, group_size=100, group_interval=0.02)
+            log.append([1, 2], [100, 200], ledger.OPEN)
+            self.assertEqual(os.path.getsize(log_path), 0)
+            # The records are committed without waiting for another append
+            deadline = time.monotonic() + 2
+            while log.offset == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(os.path.getsize(log_path), 2 * ledger.LOG_RECORD.itemsize)
+            log.close()
+            self.assertFalse(log._committer.is_alive())
+
+            log = ledger.TransactionLog(log_path, group_interval=0)
+            log.append([1], [5], ledger.DEPOSIT)
+            self.assertEqual(os.path.getsize(log_path), 3 * ledger.LOG_RECORD.itemsize)
+            log.close()
+
+    def test_cents(self):
+        accounts = ledger.Ledger([1, 2], [0.1, 250], cents=False)
+        np.testing.assert_array_equal(
+            accounts.balances_cents, np.array([10, 250 * 100])
+        )
+        accounts.open_accounts([3], [5], cents=True)
+        self.assertEqual(accounts.balance(3), 0.05)
+        self.assertRaises(ValueError, accounts.open_accounts, [4], [np.nan])
+        self.assertRaises(ValueError, accounts.open_accounts, [4], [-0.001])
+
+        accepted = accounts.apply_transactions(
+            np.ones(1000, dtype=np.int64), np.full(1000, 0.1), np.zeros(1000)
+        )
+        self.assertTrue(np.all(accepted))
+        self.assertEqual(accounts.balances_cents[0], 10010)
+        accepted = accounts.apply_transactions(
+            [2, 2, 2, 2],
+            [250, 0.01, np.nan, -0.004],
+            [ledger.WITHDRAW] * 3 + [ledger.DEPOSIT],
+            cents=False,
+        )
+        np.testing.assert_array_equal(accepted, np.array([True, False, False, False]))
+        accepted = accounts.apply_transactions([3], [5], [ledger.WITHDRAW], cents=True)
+        self.assertTrue(accepted[0])
+        self.assertEqual(accounts.balance(3), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@ Unit Test cases for physics.py
 Eben Quenneville
 7/13/2023
 """
+import os
+import tempfile
 import unittest
 import physics
 import numpy as np
@@ -281,6 +283,206 @@ class TestPhysics(unittest.TestCase):
             a, np.array([[0.0, 0.0], [0.070711, 0.070711], [0.070611, 0.070811]])
         )
 
+    def test_resume_auv2_motion(self):
+        thrusters = np.array([10, 0, 0, 0])
+        (times, x, y, theta, v, omega, a) = physics.simulate_auv2_motion(
+            thrusters, np.pi / 4, 1, 1, time_final=5
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "motion.npy")
+            checkpoint_path = os.path.join(directory, "motion.ckpt")
+            physics.simulate_auv2_motion(
+                thrusters,
+                np.pi / 4,
+                1,
+                1,
+                time_final=5,
+                output_path=output_path,
+                checkpoint_path=checkpoint_path,
+                checkpoint_interval=20,
+            )
+            # Simulate a preempted worker: rewind the checkpoint and corrupt the tail
+            checkpoint = physics.load_auv2_checkpoint(checkpoint_path)
+            self.assertEqual(checkpoint["step"], len(times) - 1)
+            buffer = np.load(output_path)
+            step = checkpoint.pop("step")
+            checkpoint.pop("state")
+            physics.save_auv2_checkpoint(checkpoint_path, 20, buffer[20], **checkpoint)
+            corrupted = np.load(output_path, mmap_mode="r+")
+            corrupted[21:, 1:] = -1
+            corrupted.flush()
+            del corrupted
+
+            resumed = physics.resume_auv2_motion(checkpoint_path)
+            np.testing.assert_array_equal(resumed[0], times)
+            np.testing.assert_array_almost_equal(resumed[1], x)
+            np.testing.assert_array_almost_equal(resumed[2], y)
+            np.testing.assert_array_almost_equal(resumed[4], v)
+            np.testing.assert_array_almost_equal(resumed[6], a)
+            self.assertEqual(
+                physics.load_auv2_checkpoint(checkpoint_path)["step"], step
+            )
+            del resumed
+
+            # Without an output file, only the remaining steps are returned
+            physics.simulate_auv2_motion(
+                thrusters,
+                np.pi / 4,
+                1,
+                1,
+                time_final=5,
+                checkpoint_path=checkpoint_path,
+                checkpoint_interval=20,
+            )
+            checkpoint = physics.load_auv2_checkpoint(checkpoint_path)
+            self.assertIsNone(checkpoint.pop("output_path"))
+            checkpoint.pop("step")
+            checkpoint.pop("state")
+            state = np.array(
+                [times[20], x[20], y[20], theta[20], *v[20], omega[20], *a[20]]
+            )
+            physics.save_auv2_checkpoint(
+                checkpoint_path, 20, state, output_path="", **checkpoint
+            )
+            resumed = physics.resume_auv2_motion(checkpoint_path)
+            np.testing.assert_array_equal(resumed[0], times[20:])
+            np.testing.assert_array_almost_equal(resumed[1], x[20:])
+            np.testing.assert_array_almost_equal(resumed[3], theta[20:])
+            # New checkpoints count steps from the start of the run, so it can resume again
+            checkpoint = physics.load_auv2_checkpoint(checkpoint_path)
+            self.assertEqual(checkpoint["step"], len(times) - 1)
+            self.assertAlmostEqual(checkpoint["state"][0], times[-1])
+            resumed = physics.resume_auv2_motion(checkpoint_path)
+            np.testing.assert_array_equal(resumed[0], times[-1:])
+            np.testing.assert_array_almost_equal(resumed[1], x[-1:])
+
+        with self.assertRaises(ValueError):
+            physics.simulate_auv2_motion(
+                thrusters, np.pi / 4, 1, 1, checkpoint_interval=0
+            )
+
+    def test_simulate_auv2_motion_batch(self):
+        thrusters = np.array([[10, 0, 0, 0], [10, 8, 0, 0], [5, -3, 2, 8]])
+        alphas = np.array([np.pi / 4, np.pi / 6, 0.3])
+        final_states = physics.simulate_auv2_motion_batch(
+            thrusters, alphas, 1, np.array([1, 2, 0.5]), time_final=5, initial_x=2
+        )
+        self.assertEqual(final_states.shape, (3, len(physics.AUV2_MOTION_COLUMNS)))
+        for i, vertical_distance in enumerate([1, 2, 0.5]):
+            (times, x, y, theta, v, omega, a) = physics.simulate_auv2_motion(
+                thrusters[i], alphas[i], 1, vertical_distance, time_final=5, initial_x=2
+            )
+            np.testing.assert_array_almost_equal(
+                final_states[i],
+                np.array(
+                    [times[-1], x[-1], y[-1], theta[-1], *v[-1], omega[-1], *a[-1]]
+                ),
+            )
+        with self.assertRaises(ValueError):
+            physics.simulate_auv2_motion_batch(np.array([10, 0, 0, 0]), 0, 1, 1)
+        with self.assertRaises(ValueError):
+            physics.simulate_auv2_motion_batch(thrusters, 0, np.array([1, -1, 1]), 1)
+        with self.assertRaises(TypeError):
+            physics.simulate_auv2_motion_batch([[10, 0, 0, 0]], 0, 1, 1)
+
+    def test_calculate_auv2_sensitivity(self):
+        thrusters = np.array([10.0, 0, 0, 0])
+        pose, jacobian = physics.calculate_auv2_sensitivity(
+            thrusters, np.pi / 4, 1, 1, time_final=1
+        )
+        self.assertEqual(jacobian.shape, (3, 7))
+        (times, x, y, theta, v, omega, a) = physics.simulate_auv2_motion(
+            thrusters, np.pi / 4, 1, 1, time_final=1
+        )
+        np.testing.assert_array_almost_equal(pose, np.array([x[-1], y[-1], theta[-1]]))
+        # theta grows with the sum of the angular velocities, which is linear in the torque
+        steps = len(times) - 1
+        expected = np.sqrt(2) / 100 * 0.1**2 * steps * (steps + 1) / 2
+        self.assertAlmostEqual(jacobian[2, 0], expected, places=6)
+        self.assertAlmostEqual(jacobian[2, 1], -expected, places=6)
+
+        # Compare against finite differences of the full simulator
+        parameters = [10.0, 0, 0, 0, np.pi / 4, 1, 1]
+        for j in range(7):
+            plus, minus = list(parameters), list(parameters)
+            plus[j] += 1e-6
+            minus[j] -= 1e-6
+            final = []
+            for values in (plus, minus):
+                (times, x, y, theta, v, omega, a) = physics.simulate_auv2_motion(
+                    np.array(values[:4]), *values[4:], time_final=1
+                )
+                final.append(np.array([x[-1], y[-1], theta[-1]]))
+            np.testing.assert_array_almost_equal(
+                jacobian[:, j], (final[0] - final[1]) / 2e-6, decimal=4
+            )
+
+    def test_optimize_auv2_thrusters(self):
+        (times, x, y, theta, v, omega, a) = physics.simulate_auv2_motion(
+            np.array([10, 2, 0, 5]), np.pi / 4, 1, 1, time_final=3
+        )
+        target = np.array([x[-1], y[-1], theta[-1]])
+        thrusters, alpha, pose, success = physics.optimize_auv2_thrusters(
+            target, np.pi / 4, 1, 1, time_final=3
+        )
+        self.assertTrue(success)
+        self.assertEqual(alpha, np.pi / 4)
+        np.testing.assert_array_almost_equal(pose, target, decimal=4)
+        (times, x, y, theta, v, omega, a) = physics.simulate_auv2_motion(
+            thrusters, alpha, 1, 1, time_final=3
+        )
+        np.testing.assert_array_almost_equal(
+            np.array([x[-1], y[-1], theta[-1]]), target, decimal=4
+        )
+
+        # Saturated thrusters cannot reach a distant target
+        thrusters, alpha, pose, success = physics.optimize_auv2_thrusters(
+            np.array([100, 0, 0]), np.pi / 4, 1, 1, time_final=3, max_thrust=5
+        )
+        self.assertFalse(success)
+        self.assertTrue(np.all(np.abs(thrusters) <= 5))
+
+        # Changing alpha as well
+        thrusters, alpha, pose, success = physics.optimize_auv2_thrusters(
+            np.array([0.5, 0.2, 0.3]), 0.1, 1, 1, time_final=3, optimize_alpha=True
+        )
+        self.assertTrue(success)
+
+        with self.assertRaises(ValueError):
+            physics.optimize_auv2_thrusters(np.array([0, 0]), np.pi / 4, 1, 1)
+        with self.assertRaises(ValueError):
+            physics.optimize_auv2_thrusters(
+                np.array([0, 0, 0]), np.pi / 4, 1, 1, max_thrust=0
+            )
+
+    def test_simulate_auv2_motion_float32(self):
+        thrusters = np.array([5, -3, 2, 8])
+        results64 = physics.simulate_auv2_motion(thrusters, np.pi / 4, 1, 1)
+        results32 = physics.simulate_auv2_motion(
+            thrusters, np.pi / 4, 1, 1, dtype=np.float32
+        )
+        for result64, result32 in zip(results64, results32):
+            self.assertEqual(result32.dtype, np.float32)
+            np.testing.assert_allclose(result32, result64, rtol=1e-5, atol=1e-5)
+
+        final64 = physics.simulate_auv2_motion_batch(
+            np.array([thrusters]), np.pi / 4, 1, 1
+        )
+        final32 = physics.simulate_auv2_motion_batch(
+            np.array([thrusters]), np.pi / 4, 1, 1, dtype=np.float32
+        )
+        self.assertEqual(final32.dtype, np.float32)
+        np.testing.assert_allclose(final32, final64, rtol=1e-5, atol=1e-5)
+
+        self.assertEqual(
+            physics.calculate_auv2_acceleration(
+                thrusters, np.pi / 4, np.float32(0.5), dtype=np.float32
+            ).dtype,
+            np.float32,
+        )
+        with self.assertRaises(TypeError):
+            physics.simulate_auv2_motion(thrusters, np.pi / 4, 1, 1, dtype=np.int32)
+
 
 if __name__ == "__main__":
     unittest.main()